@@ -4,7 +4,6 @@ from langgraph.checkpoint.redis import RedisSaver
 
 from agents.tools import tools
 from llms.chat_models import main_chat_model
-from rag.chain import chain
 from utils.redis_connection import redis_client
 
 
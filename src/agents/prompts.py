@@ -9,4 +9,17 @@ The summary should:
 4. Be concise but informative
 
 Format your summary as a brief narrative paragraph.
+"""
+
+
+MEMORY_CONSOLIDATION_PROMPT = """
+You merge near-duplicate long-term memories about a user into one canonical memory.
+Rewrite the memories below as a single concise statement that keeps every distinct
+fact, preference and detail they contain, without repeating anything. When two
+memories conflict, prefer the most recent one (the first listed).
+
+Memories:
+{memories}
+
+Canonical memory:
 """
\ No newline at end of file
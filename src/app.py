@@ -24,6 +24,8 @@ from events.chat import handle_bot_chat
 from agents.graph import build_graph
 from agents.states import RuntimeState
 from rag.chain import chain
+from memory.search_index import long_term_memory_index
+from memory.consolidation import ensure_consolidation
 from llms.chat_models import main_chat_model
 
 
@@ -35,6 +37,11 @@ def setup_page() -> None:
         initial_sidebar_state="expanded",
     )
 
+    # Build the RAG chain in the background, the page renders while documents are indexed
+    chain.warm_up()
+    # Merge and expire long-term memories periodically, once per process
+    ensure_consolidation(long_term_memory_index)
+
     if "graph" not in st.session_state:
         st.session_state.graph = chain
     if "chat_config" not in st.session_state:
@@ -46,6 +53,16 @@ def setup_page() -> None:
         st.session_state.messages = []
 
 
+def setup_sidebar() -> None:
+    status = chain.status
+    if status == "ready":
+        st.sidebar.success("Documents are indexed")
+    elif status == "failed":
+        st.sidebar.error(f"Indexing documents failed: {chain.error}")
+    else:
+        st.sidebar.info("Indexing documents, the first answer may take a while...")
+
+
 def setup_chat_interface() -> None:
     st.chat_message("assistant").markdown(
         "Hello! I am your RAG assistant. How can I help you today?"
@@ -68,6 +85,9 @@ def setup_chat_interface() -> None:
 def main():
     # Setup page
     setup_page()
+
+    # Setup sidebar
+    setup_sidebar()
     
     # Setup chat interface
     setup_chat_interface()
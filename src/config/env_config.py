@@ -13,6 +13,47 @@ class EnvConfig(BaseSettings):
     REDIS_HOST: str | None = None
     REDIS_PORT: int | None = None
 
+    MEMORY_INDEX_ALGORITHM: str = "hnsw"
+    MEMORY_INDEX_M: int = 16
+    MEMORY_INDEX_EF_CONSTRUCTION: int = 200
+    MEMORY_INDEX_EF_RUNTIME: int = 10
+    MEMORY_INDEX_DATATYPE: str = "float32"
+
+    MEMORY_CACHE_SESSIONS: int = 1000
+    MEMORY_CACHE_SIZE: int = 100
+    MEMORY_CACHE_TTL: int | None = 300
+    MEMORY_CACHE_THRESHOLD: float = 0.95
+
+    MEMORY_MERGE_THRESHOLD: float = 0.1
+    MEMORY_MAX_AGE_DAYS: float | None = 90
+    MEMORY_STALE_DAYS: float | None = 30
+    MEMORY_CONSOLIDATION: bool = True
+    MEMORY_CONSOLIDATION_SUMMARIZER: bool = False
+    MEMORY_CONSOLIDATION_INTERVAL: int = 86400
+
+    EMBEDDING_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
+    EMBEDDING_BATCH_SIZE: int = 64
+    EMBEDDING_CACHE_SIZE: int = 100_000
+    EMBEDDING_CACHE_PATH: str | None = None
+    EMBEDDING_DISK_CACHE_DIR: str | None = "./embedding_cache/disk"
+    EMBEDDING_DISK_CACHE_SIZE: int = 1_000_000
+
+    RERANKER: str = "cohere"
+    RERANKER_BACKEND: str = "torch"
+    RERANKER_FILE_NAME: str | None = None
+    RERANK_TOP_N: int = 3
+    RERANK_CANDIDATES: int = 10
+
+    SEMANTIC_CACHE_MODE: str = "retrieval"
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95
+    SEMANTIC_CACHE_TTL: int | None = 3600
+    SEMANTIC_CACHE_SIZE: int = 1000
+
+    CONTEXT_TOKEN_BUDGET: int = 2000
+    CONTEXT_DEDUP_THRESHOLD: float = 0.9
+
+    COLLECTIONS_FILE: str | None = "collections.json"
+
     class Config:
         env_file = '.env'
 
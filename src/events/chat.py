@@ -1,6 +1,8 @@
+from itertools import chain
 import streamlit as st
 from langchain_core.messages import HumanMessage, AIMessage
 from agents.states import RuntimeState
+from utils.event_loop import iterate_async
 
 
 def handle_bot_chat(question: str) -> None:
@@ -24,9 +26,12 @@ def handle_bot_chat(question: str) -> None:
 
 
 def handle_bot_chat(question: str) -> None:
-    with st.spinner(): 
-        answer =  st.session_state.graph.invoke(question)
-
-        with st.chat_message(name="ai"):
-            st.write(answer)
-        st.session_state.messages.append({"role": "ai", "content": answer})
\ No newline at end of file
+    # Runs on the shared event loop, concurrent sessions do not each block a thread on retrieval and the LLM
+    tokens = iterate_async(st.session_state.graph.astream(question))
+
+    with st.chat_message(name="ai"):
+        # The spinner covers retrieval up to the first token, the rest of the answer is written as it arrives
+        with st.spinner():
+            first_token = next(tokens, "")
+        answer = st.write_stream(chain([first_token], tokens))
+    st.session_state.messages.append({"role": "ai", "content": answer})
\ No newline at end of file
@@ -0,0 +1,119 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from typing import Dict, List, Optional
+import numpy as np
+
+
+class DiskEmbeddingCache(object):
+    def __init__(
+        self,
+        dir_path: str,
+        model_name: str,
+        max_entries: int = 1_000_000
+    ) -> None:
+        '''
+            Disk backed embedding cache: vectors live in a memory-mapped float32 matrix and a SQLite
+            table maps the hash of (model name, normalized text) to a row of that matrix
+
+            Parameters:
+                dir_path: str - The directory holding the matrix and the index
+                model_name: str - The embedding model, part of every key
+                max_entries: int - The number of rows of the matrix, least recently used rows are reused when full
+        '''
+
+        self.dir_path = dir_path
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.vectors: Optional[np.memmap] = None
+
+        os.makedirs(dir_path, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(dir_path, "index.sqlite3"), check_same_thread=False)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER UNIQUE, last_used REAL);
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER);
+            """
+        )
+
+        row = self.connection.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+        if row:
+            self.open_vectors(row[0])
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{self.normalize(text)}".encode("utf-8")).hexdigest()
+
+    def open_vectors(self, dim: int) -> None:
+        path = os.path.join(self.dir_path, "vectors.f32")
+        mode = "r+" if os.path.exists(path) else "w+"
+        self.vectors = np.memmap(path, dtype=np.float32, mode=mode, shape=(self.max_entries, dim))
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        keys = [self.key(text) for text in texts]
+
+        with self.lock:
+            if self.vectors is None:
+                return [None] * len(texts)
+
+            slots: Dict[str, int] = {}
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self.connection.execute(
+                    f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                slots.update(rows)
+
+            now = time.time()
+            self.connection.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in slots])
+            self.connection.commit()
+
+            return [np.array(self.vectors[slots[key]]) if key in slots else None for key in keys]
+
+    def put_many(self, texts: List[str], vectors: List[List[float]]) -> None:
+        if not texts:
+            return
+
+        matrix = np.asarray(vectors, dtype=np.float32)
+
+        with self.lock:
+            if self.vectors is None:
+                self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (matrix.shape[1],))
+                self.open_vectors(matrix.shape[1])
+
+            now = time.time()
+            for text, vector in zip(texts, matrix):
+                key = self.key(text)
+                row = self.connection.execute("SELECT slot FROM entries WHERE key = ?", (key,)).fetchone()
+                if row:
+                    slot = row[0]
+                else:
+                    slot = self.allocate_slot()
+                self.vectors[slot] = vector
+                self.connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, slot, now))
+
+            self.vectors.flush()
+            self.connection.commit()
+
+    def allocate_slot(self) -> int:
+        '''
+            Next free row, or the row of the least recently used entry once the matrix is full
+        '''
+
+        count = self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count < self.max_entries:
+            return count
+
+        key, slot = self.connection.execute("SELECT key, slot FROM entries ORDER BY last_used LIMIT 1").fetchone()
+        self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+        return slot
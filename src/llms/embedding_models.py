@@ -1,7 +1,222 @@
+import os
+import atexit
+import hashlib
+import threading
+from queue import Queue, Empty
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
 from langchain_huggingface import HuggingFaceEmbeddings
 from config import envConfig
+from llms.embedding_cache import DiskEmbeddingCache
 
 
-redis_embedding_model = HuggingFaceEmbeddings(
-    model_name="sentence-transformers/all-MiniLM-L6-v2",
+class EmbeddingCache(object):
+    def __init__(
+        self,
+        max_entries: int = 100_000,
+        path: Optional[str] = None
+    ) -> None:
+        '''
+            In-memory LRU cache of embeddings keyed by content hash
+
+            Parameters:
+                max_entries: int - The maximum number of embeddings kept, least recently used ones are evicted
+                path: Optional[str] - A .npz file the cache is loaded from and saved to
+        '''
+
+        self.max_entries = max_entries
+        self.path = path
+        self.entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if path and os.path.exists(path):
+            self.load()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        with self.lock:
+            self.entries[key] = vector
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def load(self) -> None:
+        with np.load(self.path) as data:
+            for key, vector in zip(data["keys"], data["vectors"]):
+                self.put(str(key), vector)
+
+    def save(self) -> None:
+        if not self.path:
+            return
+
+        with self.lock:
+            keys = np.array(list(self.entries.keys()))
+            vectors = np.stack(list(self.entries.values())) if self.entries else np.empty((0, 0), dtype=np.float32)
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(tmp_path, keys=keys, vectors=vectors)
+        os.replace(tmp_path, self.path)
+
+
+class EmbeddingService(Embeddings):
+    def __init__(
+        self,
+        model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+        batch_size: int = 64,
+        max_wait_ms: float = 5.0,
+        cache_size: int = 100_000,
+        cache_path: Optional[str] = None,
+        disk_cache_dir: Optional[str] = None,
+        disk_cache_size: int = 1_000_000
+    ) -> None:
+        '''
+            Embedding model shared by the RAG vector stores and the long-term memory. Concurrent
+            requests are coalesced by a background thread into a single forward pass, and results
+            are cached by content hash
+
+            Parameters:
+                model_name: str - The sentence-transformers model to load
+                batch_size: int - The maximum number of texts embedded in one forward pass
+                max_wait_ms: float - How long the batching thread waits for more requests before running a batch
+                cache_size: int - The maximum number of cached embeddings
+                cache_path: Optional[str] - A .npz file to persist the cache to, saved at exit
+                disk_cache_dir: Optional[str] - Directory of the disk cache consulted by embed_documents, so
+                    re-ingesting already seen chunk texts does not call the model
+                disk_cache_size: int - The maximum number of embeddings in the disk cache
+        '''
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.model = HuggingFaceEmbeddings(
+            model_name=model_name,
+            encode_kwargs={"batch_size": batch_size}
+        )
+        self.cache = EmbeddingCache(max_entries=cache_size, path=cache_path)
+        self.disk_cache = DiskEmbeddingCache(disk_cache_dir, model_name, max_entries=disk_cache_size) if disk_cache_dir else None
+
+        self.requests: Queue[Tuple[List[str], Future]] = Queue()
+        self.worker: Optional[threading.Thread] = None
+        self.worker_lock = threading.Lock()
+
+        if cache_path:
+            atexit.register(self.cache.save)
+
+    def hash_text(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def start_worker(self) -> None:
+        with self.worker_lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.run_batches, name="embedding-batcher", daemon=True)
+                self.worker.start()
+
+    def run_batches(self) -> None:
+        '''
+            Background loop: take the first pending request, then keep collecting requests until
+            the batch is full or max_wait elapsed, and embed all of them in one forward pass
+        '''
+
+        while True:
+            batch = [self.requests.get()]
+            size = len(batch[0][0])
+
+            while size < self.batch_size:
+                try:
+                    texts, future = self.requests.get(timeout=self.max_wait)
+                except Empty:
+                    break
+                batch.append((texts, future))
+                size += len(texts)
+
+            try:
+                vectors = self.model.embed_documents([text for texts, _ in batch for text in texts])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            start = 0
+            for texts, future in batch:
+                future.set_result(vectors[start:start + len(texts)])
+                start += len(texts)
+
+    def embed_uncached(self, texts: List[str]) -> List[List[float]]:
+        '''
+            Embed texts through the batching queue, large inputs are split into batch_size requests
+        '''
+
+        self.start_worker()
+
+        futures = []
+        for start in range(0, len(texts), self.batch_size):
+            future = Future()
+            self.requests.put((texts[start:start + self.batch_size], future))
+            futures.append(future)
+
+        return [vector for future in futures for vector in future.result()]
+
+    def embed(self, texts: List[str], use_disk_cache: bool) -> List[List[float]]:
+        keys = [self.hash_text(text) for text in texts]
+        vectors: List[Optional[np.ndarray]] = [self.cache.get(key) for key in keys]
+
+        # Every distinct text missing from the memory cache
+        missing = OrderedDict()
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(keys[i], texts[i])
+
+        if missing:
+            computed: Dict[str, np.ndarray] = {}
+
+            if use_disk_cache and self.disk_cache:
+                for key, vector in zip(list(missing.keys()), self.disk_cache.get_many(list(missing.values()))):
+                    if vector is not None:
+                        computed[key] = vector
+                        del missing[key]
+
+            if missing:
+                new_vectors = self.embed_uncached(list(missing.values()))
+                if use_disk_cache and self.disk_cache:
+                    self.disk_cache.put_many(list(missing.values()), new_vectors)
+                computed.update((key, np.asarray(vector, dtype=np.float32)) for key, vector in zip(missing.keys(), new_vectors))
+
+            for key, vector in computed.items():
+                self.cache.put(key, vector)
+            vectors = [computed[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+
+        return [vector.tolist() for vector in vectors]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed(texts, use_disk_cache=True)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed([text], use_disk_cache=False)[0]
+
+embedding_service = EmbeddingService(
+    model_name=envConfig.EMBEDDING_MODEL,
+    batch_size=envConfig.EMBEDDING_BATCH_SIZE,
+    cache_size=envConfig.EMBEDDING_CACHE_SIZE,
+    cache_path=envConfig.EMBEDDING_CACHE_PATH,
+    disk_cache_dir=envConfig.EMBEDDING_DISK_CACHE_DIR,
+    disk_cache_size=envConfig.EMBEDDING_DISK_CACHE_SIZE
 )
+
+# Kept for the long-term memory modules, shares the model and cache with the vector stores
+redis_embedding_model = embedding_service
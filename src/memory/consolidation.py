@@ -0,0 +1,317 @@
+import sys
+import json
+import time
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from redisvl.index import SearchIndex
+from redisvl.query import FilterQuery
+from redisvl.query.filter import Tag
+from enums.memory_type import MemoryType
+from models.memory import ConsolidationReport
+from llms.embedding_models import redis_embedding_model
+from agents.prompts import MEMORY_CONSOLIDATION_PROMPT
+from memory.store import MemoryCache, memory_cache
+from loggers.logger import logger
+from config import envConfig
+
+
+# Distance under which store_memory treats two memories as duplicates
+DUPLICATE_THRESHOLD = 0.1
+
+
+def decode(value: Any) -> Any:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def user_ids(long_term_memory_index: SearchIndex) -> List[str]:
+    # TAGVALS lowercases the values, tag queries are case-insensitive so they still select the user
+    return [decode(value) for value in long_term_memory_index.client.ft(long_term_memory_index.name).tagvals("user_id")]
+
+
+def load_memories(long_term_memory_index: SearchIndex, user_id: str, page_size: int = 500) -> List[Dict[str, Any]]:
+    '''
+        Read every memory document of a user, embeddings included, with the Redis key under "key"
+    '''
+
+    query = FilterQuery(filter_expression=Tag("user_id") == user_id, return_fields=["memory_id"])
+    keys = [doc["id"] for page in long_term_memory_index.paginate(query, page_size=page_size) for doc in page]
+
+    memories = []
+    for start in range(0, len(keys), page_size):
+        batch = keys[start:start + page_size]
+        for key, doc in zip(batch, long_term_memory_index.client.json().mget(batch, "$")):
+            if doc:
+                # A "$" path returns a list with the root document
+                memories.append({**(doc[0] if isinstance(doc, list) else doc), "key": key})
+
+    return memories
+
+
+def cluster(vectors: np.ndarray, threshold: float) -> List[List[int]]:
+    '''
+        Greedy leader clustering: the first unassigned row (the most recent memory) takes every
+        unassigned row within threshold cosine distance
+
+        Parameters:
+            vectors: np.ndarray - The (n, dim) normalized embeddings, most recent first
+            threshold: float - The maximum cosine distance to the leader
+    '''
+
+    unassigned = np.ones(len(vectors), dtype=bool)
+    clusters = []
+    for leader in range(len(vectors)):
+        if not unassigned[leader]:
+            continue
+
+        members = np.flatnonzero(unassigned & (vectors @ vectors[leader] >= 1 - threshold))
+        unassigned[members] = False
+        clusters.append([leader] + [member for member in members.tolist() if member != leader])
+
+    return clusters
+
+
+class MemoryConsolidator(object):
+    def __init__(
+        self,
+        long_term_memory_index: SearchIndex,
+        merge_threshold: float = 0.1,
+        max_age_days: Optional[float] = 90,
+        stale_days: Optional[float] = 30,
+        expire_types: Tuple[MemoryType, ...] = (MemoryType.EPISODIC,),
+        use_summarizer: bool = False
+    ) -> None:
+        '''
+            Keeps the long-term memory of each user bounded. Memories of the same type and thread are
+            clustered by embedding and every cluster collapses into one canonical memory, the most recent
+            one, optionally rewritten by the summarizer to keep the facts of the others. Without the
+            summarizer the other memories are deleted as they are, so only near-duplicates are merged: the
+            threshold is capped at the 0.1 duplicate threshold of store_memory. Memories older than
+            max_age_days that were not retrieved for stale_days are expired
+
+            Parameters:
+                long_term_memory_index: SearchIndex - The memory index
+                merge_threshold: float - The cosine distance under which memories are merged, with the
+                    summarizer it can be raised to catch paraphrases
+                max_age_days: Optional[float] - The age after which unused memories may expire, None to never expire
+                stale_days: Optional[float] - The time since the last retrieval after which an old memory expires
+                expire_types: Tuple[MemoryType, ...] - The memory types that expire, semantic facts are kept by default
+                use_summarizer: bool - Whether to rewrite merged clusters with the summarizer model
+        '''
+
+        self.index = long_term_memory_index
+        self.merge_threshold = merge_threshold
+        self.max_age_days = max_age_days
+        self.stale_days = stale_days
+        self.expire_types = {memory_type.value for memory_type in expire_types}
+        self.use_summarizer = use_summarizer
+        self.threshold = merge_threshold if use_summarizer else min(merge_threshold, DUPLICATE_THRESHOLD)
+
+    def expired(self, memory: Dict[str, Any], last_used: Optional[float], now: float) -> bool:
+        if self.max_age_days is None or memory.get("memory_type") not in self.expire_types:
+            return False
+
+        try:
+            created_at = datetime.fromisoformat(memory["created_at"]).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return False
+
+        if now - created_at < self.max_age_days * 86400:
+            return False
+
+        last_used = max(last_used or 0, created_at)
+        return self.stale_days is None or now - last_used >= self.stale_days * 86400
+
+    def summarize(self, contents: List[str]) -> str:
+        # Imported on use, the summarizer client needs the Google API key
+        from llms.summerizer_model import summarizer
+
+        prompt = MEMORY_CONSOLIDATION_PROMPT.format(memories="\n".join(f"- {content}" for content in contents))
+        return str(summarizer.invoke(prompt).content).strip()
+
+    def consolidate_user(self, user_id: str, report: ConsolidationReport, exact: bool = True) -> None:
+        '''
+            Consolidate the memories of a user. Tag queries are case-insensitive, "Alice" also loads the
+            memories of "alice": the memories of another stored user id are dropped, or with exact=False
+            (for the lowercased TAGVALS ids) consolidated apart
+        '''
+
+        users: Dict[str, List[Dict[str, Any]]] = {}
+        for memory in load_memories(self.index, user_id):
+            stored_user_id = memory.get("user_id", user_id)
+            if not exact or stored_user_id == user_id:
+                users.setdefault(stored_user_id, []).append(memory)
+
+        for stored_user_id, memories in users.items():
+            self.consolidate_memories(stored_user_id, memories, report)
+
+    def consolidate_memories(self, user_id: str, memories: List[Dict[str, Any]], report: ConsolidationReport) -> None:
+        client, usage_key = self.index.client, MemoryCache.usage_key(user_id)
+        usage = {decode(key): score for key, score in client.zrange(usage_key, 0, -1, withscores=True)}
+
+        now = time.time()
+        expired = [memory["key"] for memory in memories if self.expired(memory, usage.get(memory["key"]), now)]
+        expired_keys = set(expired)
+        memories = [memory for memory in memories if memory["key"] not in expired_keys]
+
+        groups: Dict[Tuple[Any, Any, Any], List[Dict[str, Any]]] = {}
+        for memory in memories:
+            groups.setdefault((memory.get("user_id"), memory.get("memory_type"), memory.get("thread_id")), []).append(memory)
+
+        clusters = []
+        for group in groups.values():
+            group.sort(key=lambda memory: memory.get("created_at", ""), reverse=True)
+            vectors = np.asarray([memory["embedding"] for memory in group], dtype=np.float32)
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+            for members in cluster(vectors, self.threshold):
+                if len(members) > 1:
+                    clusters.append((group[members[0]], [group[member] for member in members[1:]]))
+
+        if self.use_summarizer and clusters:
+            rewritten = []
+            for canonical, duplicates in clusters:
+                try:
+                    content = self.summarize([canonical["content"]] + [duplicate["content"] for duplicate in duplicates])
+                except Exception as e:
+                    # Without the rewrite the duplicates may hold facts the canonical memory lacks, keep them all
+                    logger.error(f"Error summarizing memories of user {user_id}, cluster skipped: {e}")
+                    continue
+                rewritten.append((canonical, duplicates, content))
+
+            embeddings = redis_embedding_model.embed_documents([content for _, _, content in rewritten]) if rewritten else []
+            for (canonical, _, content), embedding in zip(rewritten, embeddings):
+                canonical["content"], canonical["embedding"] = content, embedding
+            clusters = [(canonical, duplicates) for canonical, duplicates, _ in rewritten]
+
+        merged_keys, updates = [], []
+        for canonical, duplicates in clusters:
+            merged_keys.extend(duplicate["key"] for duplicate in duplicates)
+            report.clusters_merged += 1
+
+            metadata = {
+                "consolidated_from": [duplicate.get("memory_id") for duplicate in duplicates],
+                "consolidated_at": datetime.now().isoformat()
+            }
+            try:
+                previous = json.loads(canonical.get("metadata") or "{}")
+                if isinstance(previous, dict):
+                    metadata = {**previous, **metadata, "consolidated_from": previous.get("consolidated_from", []) + metadata["consolidated_from"]}
+            except ValueError:
+                pass
+
+            updates.append((canonical, metadata, max(usage.get(memory["key"], 0) for memory in [canonical] + duplicates)))
+
+        pipeline = client.pipeline(transaction=False)
+        for canonical, metadata, last_used in updates:
+            canonical["metadata"] = json.dumps(metadata)
+            pipeline.json().set(canonical["key"], "$", {key: value for key, value in canonical.items() if key != "key"})
+            if last_used:
+                pipeline.zadd(usage_key, {canonical["key"]: last_used})
+
+        removed = expired + merged_keys
+        if removed:
+            pipeline.delete(*removed)
+            pipeline.zrem(usage_key, *removed)
+        pipeline.execute()
+
+        if updates or removed:
+            memory_cache.invalidate(self.index, user_id)
+
+        report.memories_before += len(memories) + len(expired)
+        report.memories_after += len(memories) - len(merged_keys)
+        report.memories_merged += len(merged_keys)
+        report.memories_expired += len(expired)
+
+    def run(self, users: Optional[List[str]] = None) -> ConsolidationReport:
+        '''
+            Consolidate the memories of the given users, all users by default
+        '''
+
+        start = time.perf_counter()
+        report = ConsolidationReport()
+
+        for user_id in users or user_ids(self.index):
+            try:
+                self.consolidate_user(user_id, report, exact=users is not None)
+                report.users += 1
+            except Exception as e:
+                # One failing user should not stop the job
+                logger.error(f"Error consolidating memories of user {user_id}: {e}")
+
+        report.duration_seconds = time.perf_counter() - start
+        logger.info(
+            f"Memory consolidation: {report.memories_before} -> {report.memories_after} memories "
+            f"({report.reduction:.1%} smaller, {report.memories_merged} merged, {report.memories_expired} expired) "
+            f"for {report.users} users in {report.duration_seconds:.1f}s"
+        )
+
+        return report
+
+
+def start_consolidation(
+    consolidator: MemoryConsolidator,
+    interval_seconds: Optional[float] = None
+) -> threading.Event:
+    '''
+        Run the consolidation in a daemon thread every interval_seconds (MEMORY_CONSOLIDATION_INTERVAL
+        by default), set the returned event to stop it. Every app process starts the thread, a key in
+        Redis lets only one of them run per interval
+    '''
+
+    interval_seconds = interval_seconds or envConfig.MEMORY_CONSOLIDATION_INTERVAL
+    stopped = threading.Event()
+    claim_key = f"{consolidator.index.name}:consolidation"
+
+    def loop() -> None:
+        while not stopped.wait(interval_seconds):
+            try:
+                claimed = consolidator.index.client.set(claim_key, 1, nx=True, ex=max(1, int(interval_seconds) - 1))
+            except Exception as e:
+                logger.error(f"Error claiming the memory consolidation: {e}")
+                continue
+            if claimed:
+                consolidator.run()
+
+    threading.Thread(target=loop, name="memory-consolidation", daemon=True).start()
+
+    return stopped
+
+
+consolidation_lock = threading.Lock()
+consolidation_stopped: Optional[threading.Event] = None
+
+
+def ensure_consolidation(long_term_memory_index: SearchIndex) -> None:
+    '''
+        Start the background consolidation of this process if MEMORY_CONSOLIDATION is on, no-op if
+        it is off or already started
+    '''
+
+    global consolidation_stopped
+
+    with consolidation_lock:
+        if not envConfig.MEMORY_CONSOLIDATION or consolidation_stopped is not None:
+            return
+
+        consolidation_stopped = start_consolidation(build_consolidator(long_term_memory_index))
+        logger.info(f"Memory consolidation scheduled every {envConfig.MEMORY_CONSOLIDATION_INTERVAL}s")
+
+
+def build_consolidator(long_term_memory_index: SearchIndex) -> MemoryConsolidator:
+    return MemoryConsolidator(
+        long_term_memory_index,
+        merge_threshold=envConfig.MEMORY_MERGE_THRESHOLD,
+        max_age_days=envConfig.MEMORY_MAX_AGE_DAYS,
+        stale_days=envConfig.MEMORY_STALE_DAYS,
+        use_summarizer=envConfig.MEMORY_CONSOLIDATION_SUMMARIZER
+    )
+
+
+if __name__ == "__main__":
+    # PYTHONPATH=src python -m src.memory.consolidation [user_id ...]
+    from memory.search_index import long_term_memory_index
+
+    report = build_consolidator(long_term_memory_index).run(sys.argv[1:] or None)
+    print(report.model_dump_json(indent=2))
@@ -1,52 +1,365 @@
 import os
+import sys
+import json
+import time
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional
+import numpy as np
 from redis import Redis
+from redis.exceptions import ResponseError
 from redisvl.index import SearchIndex
+from redisvl.query import VectorRangeQuery
+from redisvl.query.filter import Tag
 from redisvl.schema.schema import IndexSchema
+from config import envConfig
+from loggers.logger import logger
 from src.utils.redis_connection import redis_client
 
 
-schema = {
-    "index": {
-        "name": "agent_memories",
-        "prefix": "memory",
-        "key_seperator": ":",
-        "storage_type": "json"
-    },
-    "fields": [
-        {"name": "content", "type": "text"},
-        {"name": "memory_type", "type": "tag"},
-        {"name": "metadata", "type": "text"},
-        {"name": "created_at", "type": "text"},
-        {"name": "user_id", "type": "tag"},
-        {"name": "memory_id", "type": "tag"},
-        {
-            "name": "embedding",
-            "type": "vector",
-            "attrs": {
-                "algorithm": "flat",
-                "dims": 384,
-                "distance_metric": "cosine",
-                "datatype": "float32"
-            }
-        }
+# Half precision halves the vector memory of the index, the JSON documents keep the full embeddings
+DATATYPES = ("float32", "float16", "bfloat16")
+
+
+def vector_attrs(algorithm: Optional[str] = None, dims: int = 384, datatype: Optional[str] = None) -> Dict[str, Any]:
+    '''
+        Attributes of the embedding field. FLAT is an exact brute-force scan, fine for a few thousand
+        memories; HNSW is a graph index whose query cost grows logarithmically with the memory count
+
+        Parameters:
+            algorithm: Optional[str] - "flat" or "hnsw", MEMORY_INDEX_ALGORITHM by default
+            dims: int - The dimension of the embeddings
+            datatype: Optional[str] - One of DATATYPES, MEMORY_INDEX_DATATYPE by default
+    '''
+
+    algorithm = (algorithm or envConfig.MEMORY_INDEX_ALGORITHM).lower()
+    datatype = (datatype or envConfig.MEMORY_INDEX_DATATYPE).lower()
+    if datatype not in DATATYPES:
+        raise ValueError(f"Invalid memory index datatype: {datatype}")
+
+    attrs = {
+        "algorithm": algorithm,
+        "dims": dims,
+        "distance_metric": "cosine",
+        "datatype": datatype
+    }
+
+    if algorithm == "hnsw":
+        attrs.update({
+            "m": envConfig.MEMORY_INDEX_M,
+            "ef_construction": envConfig.MEMORY_INDEX_EF_CONSTRUCTION,
+            "ef_runtime": envConfig.MEMORY_INDEX_EF_RUNTIME
+        })
+    elif algorithm != "flat":
+        raise ValueError(f"Invalid memory index algorithm: {algorithm}")
+
+    return attrs
+
+
+def build_schema(
+    name: str = "agent_memories",
+    prefix: str = "memory",
+    algorithm: Optional[str] = None
+) -> Dict[str, Any]:
+    return {
+        "index": {
+            "name": name,
+            "prefix": prefix,
+            "key_seperator": ":",
+            "storage_type": "json"
+        },
+        "fields": [
+            {"name": "content", "type": "text"},
+            {"name": "memory_type", "type": "tag"},
+            {"name": "metadata", "type": "text"},
+            {"name": "created_at", "type": "text"},
+            {"name": "user_id", "type": "tag"},
+            {"name": "thread_id", "type": "tag"},
+            {"name": "memory_id", "type": "tag"},
+            {"name": "embedding", "type": "vector", "attrs": vector_attrs(algorithm)}
+        ]
+    }
+
+
+schema = build_schema()
+
+
+def wait_for_indexing(index: SearchIndex, timeout: float = 600, interval: float = 0.5) -> None:
+    '''
+        Block until Redis has finished indexing the existing documents of the index
+    '''
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        info = index.info()
+        if float(info.get("percent_indexed", 1)) >= 1 and not int(info.get("indexing", 0)):
+            return
+        time.sleep(interval)
+
+    raise TimeoutError(f"Index {index.name} is still indexing after {timeout}s")
+
+
+# Query-time parameters, changing them must not rebuild the index
+QUERY_ATTRS = ("ef_runtime", "epsilon")
+
+
+def schema_hash(schema: Dict[str, Any]) -> str:
+    fields = [
+        {**field, "attrs": {key: value for key, value in field["attrs"].items() if key not in QUERY_ATTRS}} if "attrs" in field else field
+            for field in schema["fields"]
     ]
-}
 
+    return hashlib.sha256(json.dumps({**schema, "fields": fields}, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def versioned_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+        The schema of the physical index: the name is the alias suffixed with the schema hash, so a
+        schema change creates a new index next to the one serving queries
+    '''
+
+    alias = schema["index"]["name"]
+    return {**schema, "index": {**schema["index"], "name": f"{alias}_{schema_hash(schema)}"}}
+
+
+def record_version(redis_client: Redis, alias: str, index: SearchIndex, schema: Dict[str, Any]) -> None:
+    '''
+        Record the index serving the alias and its vector datatype, query vectors must be encoded with
+        the datatype of the serving index (see memory.store.query_dtype)
+    '''
+
+    datatype = next(field["attrs"]["datatype"] for field in schema["fields"] if field["type"] == "vector")
+    redis_client.mset({f"{alias}:schema": index.name, f"{alias}:datatype": datatype})
+
+
+def decode(value: Any) -> Any:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def alias_target(redis_client: Redis, alias: str) -> Optional[str]:
+    '''
+        The name of the index the alias resolves to, the alias itself for a legacy index created under
+        that name, None if there is neither
+    '''
 
-def create_search_index(redis_client: Redis) -> SearchIndex | None:
     try:
-        memory_schema = IndexSchema.from_dict(schema)
-        long_term_memory_index = SearchIndex(
-            schema=memory_schema,
-            redis_client=redis_client,
-            validate_on_load=True
-        )
+        info = redis_client.ft(alias).info()
+    except ResponseError:
+        return None
+
+    return decode(info.get("index_name", info.get(b"index_name")))
+
+
+def swap_alias(redis_client: Redis, alias: str, name: str) -> None:
+    target = alias_target(redis_client, alias)
+    if target == name:
+        return
+
+    if target == alias:
+        # An index created under the alias name blocks the alias, drop it and keep its documents
+        redis_client.ft(alias).dropindex(delete_documents=False)
+        target = None
+
+    redis_client.ft(name).aliasupdate(alias)
 
-        long_term_memory_index.create(overwrite=True)
+    if target:
+        redis_client.ft(target).dropindex(delete_documents=False)
+        logger.info(f"Memory index alias {alias} moved from {target} to {name}")
 
-        return long_term_memory_index
+
+def migrate_search_index(
+    redis_client: Redis,
+    index: SearchIndex,
+    schema: Dict[str, Any],
+    timeout: float = 600
+) -> None:
+    '''
+        Build the physical index of a new schema and move the alias to it once the documents are
+        re-indexed. Only one worker migrates, the others keep serving through the alias meanwhile
+    '''
+
+    alias = schema["index"]["name"]
+    version_key = f"{alias}:schema"
+    lock = redis_client.lock(f"{alias}:migration", timeout=timeout + 60)
+    if not lock.acquire(blocking=False):
+        logger.info(f"Memory index {index.name} is being built by another worker")
+        return
+
+    try:
+        if decode(redis_client.get(version_key)) == index.name and index.exists():
+            return
+
+        if not index.exists():
+            logger.info(f"Creating memory index {index.name}")
+            index.create()
+        wait_for_indexing(index, timeout)
+
+        swap_alias(redis_client, alias, index.name)
+        record_version(redis_client, alias, index, schema)
     except Exception as e:
-        return None
-    
+        logger.error(f"Error migrating memory index {index.name}: {e}")
+    finally:
+        lock.release()
+
+
+def create_search_index(
+    redis_client: Redis,
+    schema: Dict[str, Any] = schema,
+    timeout: float = 600
+) -> SearchIndex:
+    '''
+        Open the memory index, creating it only if the schema changed. The physical index is named
+        after the schema hash and the hash is recorded in Redis, so a worker starting with an unchanged
+        schema issues no write at all. On a schema change the new index is built in a background
+        thread next to the old one, which keeps serving queries through the alias until the documents
+        are re-indexed; the alias is then swapped and the old index dropped without its documents.
+        The returned index queries through the alias, so it stays valid across the swap
+
+        Parameters:
+            redis_client: Redis - The Redis connection
+            schema: Dict[str, Any] - The index schema, its name is used as the alias
+            timeout: float - The maximum number of seconds the background re-index may take
+    '''
+
+    alias = schema["index"]["name"]
+    version_key = f"{alias}:schema"
+    index = SearchIndex(
+        schema=IndexSchema.from_dict(versioned_schema(schema)),
+        redis_client=redis_client,
+        validate_on_load=True
+    )
+
+    aliased_index = SearchIndex(
+        schema=IndexSchema.from_dict(schema),
+        redis_client=redis_client,
+        validate_on_load=True
+    )
+
+    try:
+        if decode(redis_client.get(version_key)) == index.name and index.exists():
+            return aliased_index
+
+        if alias_target(redis_client, alias) is None:
+            # Nothing serves the alias yet: create the index and point the alias at it right away,
+            # Redis indexes the existing documents in the background
+            with redis_client.lock(f"{alias}:migration", timeout=60, blocking_timeout=60):
+                if alias_target(redis_client, alias) is None:
+                    if not index.exists():
+                        logger.info(f"Creating memory index {index.name}")
+                        index.create()
+                    swap_alias(redis_client, alias, index.name)
+                    record_version(redis_client, alias, index, schema)
+
+            if decode(redis_client.get(version_key)) == index.name:
+                return aliased_index
+    except Exception as e:
+        logger.error(f"Error creating memory index {index.name}: {e}")
+        raise
+
+    threading.Thread(
+        target=migrate_search_index,
+        args=(redis_client, index, schema, timeout),
+        name="memory-index-migration",
+        daemon=True
+    ).start()
+
+    return aliased_index
+
+
+long_term_memory_index = create_search_index(redis_client)
+
+
+def benchmark(
+    redis_client: Redis,
+    counts: List[int] = [1_000, 10_000, 50_000],
+    n_users: int = 100,
+    n_queries: int = 100,
+    distance_threshold: float = 0.3,
+    dims: int = 384
+) -> None:
+    '''
+        Print the latency of a per-user memory range query against the FLAT and HNSW indexes as the
+        number of stored memories grows, and the recall of HNSW against the exact FLAT results.
+        Both indexes cover the same synthetic documents, which are deleted afterwards
+
+        Parameters:
+            redis_client: Redis - The Redis connection
+            counts: List[int] - The memory counts to measure at
+            n_users: int - The number of users the memories are spread over
+            n_queries: int - The number of queries per measurement
+            distance_threshold: float - The cosine distance of the range queries
+            dims: int - The dimension of the embeddings
+    '''
+
+    # Not under the "memory" prefix, or the serving index would pick the documents up
+    prefix = "benchmark_memory"
+    indexes = {}
+    for algorithm in ("flat", "hnsw"):
+        index_schema = build_schema(name=f"{prefix}_{algorithm}", prefix=prefix, algorithm=algorithm)
+        index_schema["fields"][-1]["attrs"]["dims"] = dims
+        indexes[algorithm] = SearchIndex(schema=IndexSchema.from_dict(index_schema), redis_client=redis_client)
+        indexes[algorithm].create(overwrite=True, drop=True)
+
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((64, dims)).astype(np.float32)
+
+    def sample(n: int) -> np.ndarray:
+        vectors = centers[rng.integers(0, len(centers), n)] + 0.6 * rng.standard_normal((n, dims)).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    print(f"{'memories':>9} {'flat ms':>8} {'hnsw ms':>8} {'hnsw recall':>12}")
+    try:
+        loaded = 0
+        for count in counts:
+            vectors = sample(count - loaded)
+            indexes["flat"].load(
+                [
+                    {
+                        "user_id": f"user-{(loaded + i) % n_users}",
+                        "memory_type": "semantic",
+                        "content": f"memory {loaded + i}",
+                        "memory_id": str(loaded + i),
+                        "embedding": vector.tolist()
+                    }
+                    for i, vector in enumerate(vectors)
+                ],
+                id_field="memory_id"
+            )
+            loaded = count
+            for index in indexes.values():
+                wait_for_indexing(index)
+
+            queries = sample(n_queries)
+            latencies, found = {}, {}
+            for algorithm, index in indexes.items():
+                start = time.perf_counter()
+                found[algorithm] = [
+                    {
+                        result["id"] for result in index.query(VectorRangeQuery(
+                            vector=query.tolist(),
+                            vector_field_name="embedding",
+                            filter_expression=Tag("user_id") == f"user-{i % n_users}",
+                            distance_threshold=distance_threshold,
+                            num_results=5,
+                            return_fields=["id"],
+                            dtype=envConfig.MEMORY_INDEX_DATATYPE.lower()
+                        ))
+                    }
+                    for i, query in enumerate(queries)
+                ]
+                latencies[algorithm] = (time.perf_counter() - start) * 1000 / n_queries
+
+            hits = [(len(exact & approximate), len(exact)) for exact, approximate in zip(found["flat"], found["hnsw"]) if exact]
+            recall = sum(hit for hit, _ in hits) / max(sum(total for _, total in hits), 1)
+
+            print(f"{count:>9} {latencies['flat']:>8.2f} {latencies['hnsw']:>8.2f} {recall:>12.3f}")
+    finally:
+        indexes["flat"].delete(drop=True)
+        indexes["hnsw"].delete(drop=False)
+
+
+if __name__ == "__main__":
+    # PYTHONPATH=src python -m src.memory.search_index [count ...]
+    counts = [int(count) for count in sys.argv[1:]] or [1_000, 10_000, 50_000]
 
-long_term_memory_index = create_search_index(redis_client)
\ No newline at end of file
+    benchmark(redis_client, counts)
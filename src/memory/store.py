@@ -1,39 +1,168 @@
+import time
+import threading
+from collections import OrderedDict
 from ulid import ULID
-from typing import Optional, Union, List
+from typing import Any, Dict, Optional, Tuple, Union, List
 from datetime import datetime
+import numpy as np
+from redis.exceptions import ResponseError
 from redisvl.query import VectorRangeQuery
 from redisvl.query.filter import Tag
 from redisvl.index import SearchIndex
 from enums.memory_type import MemoryType
-from models.memory import StoredMemory
+from models.memory import Memory, StoredMemory
 from llms.embedding_models import redis_embedding_model
+from rag.semantic_cache import SemanticCache
+from loggers.logger import logger
+from config import envConfig
 
 
 SYSTEM_USER_ID = "system"
 
 
-def similar_memory_exists(
-    long_term_memory_index: SearchIndex,
-    content: str,
+class MemoryCache(object):
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        max_entries: int = 100,
+        ttl_seconds: Optional[float] = 300,
+        threshold: float = 0.95
+    ) -> None:
+        '''
+            Per user and thread cache of memory retrievals, so repeated or paraphrased questions within a
+            session skip the embedding and the Redis vector search. Each session is a SemanticCache whose
+            version is a per-user counter in Redis, incremented whenever a memory is stored for the user,
+            so every worker drops its cached retrievals of that user on the next lookup
+
+            Parameters:
+                max_sessions: int - The maximum number of cached (user, thread, query options) sessions
+                max_entries: int - The maximum number of cached queries per session
+                ttl_seconds: Optional[float] - The lifetime of a cached retrieval
+                threshold: float - The minimum cosine similarity of two queries sharing a result
+        '''
+
+        self.max_sessions = max_sessions
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.sessions: "OrderedDict[Tuple[Any, ...], SemanticCache]" = OrderedDict()
+
+    @staticmethod
+    def version_key(user_id: str) -> str:
+        # Outside the "memory" prefix, the key must not be picked up by the memory index
+        return f"agent_memories:version:{user_id}"
+
+    @staticmethod
+    def usage_key(user_id: str) -> str:
+        # Sorted set of the user's memory keys scored by their last retrieval time
+        return f"agent_memories:usage:{user_id}"
+
+    def session(
+        self,
+        long_term_memory_index: SearchIndex,
+        user_id: str,
+        thread_id: Optional[str],
+        options: Tuple[Any, ...]
+    ) -> SemanticCache:
+        key = (user_id, thread_id, options)
+        with self.lock:
+            cache = self.sessions.get(key)
+            if cache is not None:
+                self.sessions.move_to_end(key)
+                return cache
+
+        client, version_key = long_term_memory_index.client, self.version_key(user_id)
+        cache = SemanticCache(
+            redis_embedding_model,
+            threshold=self.threshold,
+            ttl_seconds=self.ttl_seconds,
+            max_entries=self.max_entries,
+            version=lambda: client.get(version_key),
+            name=f"memory ({user_id})"
+        )
+
+        with self.lock:
+            cache = self.sessions.setdefault(key, cache)
+            self.sessions.move_to_end(key)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+        return cache
+
+    def invalidate(self, long_term_memory_index: SearchIndex, user_id: str) -> None:
+        long_term_memory_index.client.incr(self.version_key(user_id))
+
+
+memory_cache = MemoryCache(
+    max_sessions=envConfig.MEMORY_CACHE_SESSIONS,
+    max_entries=envConfig.MEMORY_CACHE_SIZE,
+    ttl_seconds=envConfig.MEMORY_CACHE_TTL,
+    threshold=envConfig.MEMORY_CACHE_THRESHOLD
+)
+
+
+datatypes: Dict[str, Tuple[str, float]] = {}
+
+
+def query_dtype(long_term_memory_index: SearchIndex, refresh_seconds: float = 30) -> str:
+    '''
+        Vector datatype of the index serving the alias, recorded by memory.search_index when the alias
+        moves. Read from Redis at most every refresh_seconds, so a datatype change applies to queries
+        only once the re-indexed index serves them
+    '''
+
+    name = long_term_memory_index.name
+    cached = datatypes.get(name)
+    if cached is None or time.monotonic() - cached[1] > refresh_seconds:
+        value = long_term_memory_index.client.get(f"{name}:datatype")
+        value = value.decode("utf-8") if isinstance(value, bytes) else value
+        cached = datatypes[name] = (value or "float32", time.monotonic())
+
+    return cached[0]
+
+
+def duplicate_query(
+    embedding: List[float],
     memory_type: MemoryType,
     user_id: str = SYSTEM_USER_ID,
     thread_id: Optional[str] = None,
-    distance_threshold: float = 0.1
-) -> bool:
-    content_embedding = redis_embedding_model.embed_query(content)
-
+    distance_threshold: float = 0.1,
+    dtype: str = "float32"
+) -> VectorRangeQuery:
     filters = (Tag("user_id") == user_id) & (Tag("memory_type") == memory_type)
 
     if thread_id:
         filters = filters & (Tag("thread_id") == thread_id)
 
-    vector_query = VectorRangeQuery(
-        vector=content_embedding,
+    return VectorRangeQuery(
+        vector=embedding,
         num_results=1,
         vector_field_name="embedding",
         filter_expression=filters,
         distance_threshold=distance_threshold,
-        return_fields=["id"]
+        return_fields=["id"],
+        dtype=dtype
+    )
+
+
+def similar_memory_exists(
+    long_term_memory_index: SearchIndex,
+    content: str,
+    memory_type: MemoryType,
+    user_id: str = SYSTEM_USER_ID,
+    thread_id: Optional[str] = None,
+    distance_threshold: float = 0.1
+) -> bool:
+    content_embedding = redis_embedding_model.embed_query(content)
+
+    vector_query = duplicate_query(
+        content_embedding,
+        memory_type,
+        user_id,
+        thread_id,
+        distance_threshold,
+        query_dtype(long_term_memory_index)
     )
 
     results = long_term_memory_index.query(vector_query)
@@ -44,6 +173,111 @@ def similar_memory_exists(
     return False
 
 
+def existing_duplicates(
+    long_term_memory_index: SearchIndex,
+    queries: List[VectorRangeQuery]
+) -> List[bool]:
+    '''
+        Run the duplicate range queries in one pipelined round-trip, returns whether each one matched
+    '''
+
+    if not queries:
+        return []
+
+    pipeline = long_term_memory_index.client.pipeline(transaction=False)
+    for query in queries:
+        pipeline.ft(long_term_memory_index.name).search(query, query_params=query.params)
+
+    found = []
+    for response in pipeline.execute():
+        # RESP2 replies [total, ...], RESP3 replies a map
+        total = response.get("total_results", 0) if isinstance(response, dict) else response[0]
+        found.append(total > 0)
+
+    return found
+
+
+def store_memories(
+    long_term_memory_index: SearchIndex,
+    memories: List[Memory],
+    user_id: str = SYSTEM_USER_ID,
+    thread_id: Optional[str] = None,
+    distance_threshold: float = 0.1
+) -> List[Optional[str]]:
+    '''
+        Store a batch of memories: one embedding pass for the whole batch, duplicates dropped both
+        within the batch and against the index (one pipelined round-trip), and one pipelined write
+
+        Parameters:
+            long_term_memory_index: SearchIndex - The memory index
+            memories: List[Memory] - The memories to store
+            user_id: str - The owner of the memories
+            thread_id: Optional[str] - The conversation thread the memories belong to
+            distance_threshold: float - The cosine distance under which two memories are duplicates
+
+        Returns:
+            List[Optional[str]] - The memory id of each stored memory, None for duplicates
+    '''
+
+    if not memories:
+        return []
+
+    user_id = user_id or SYSTEM_USER_ID
+    embeddings = redis_embedding_model.embed_documents([memory.content for memory in memories])
+
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    # Within-batch duplicates: a memory close to an earlier one of the same type is dropped
+    candidates = []
+    for i, memory in enumerate(memories):
+        duplicate = any(
+            memories[j].memory_type == memory.memory_type and 1 - float(vectors[i] @ vectors[j]) < distance_threshold
+                for j in candidates
+        )
+        if not duplicate:
+            candidates.append(i)
+
+    dtype = query_dtype(long_term_memory_index)
+    try:
+        found = existing_duplicates(
+            long_term_memory_index,
+            [
+                duplicate_query(embeddings[i], memories[i].memory_type, user_id, thread_id, distance_threshold, dtype)
+                    for i in candidates
+            ]
+        )
+    except ResponseError as e:
+        # The index can be missing while it is created or migrated, a duplicate beats a lost memory
+        logger.error(f"Error looking up duplicate memories of user {user_id}, storing them unchecked: {e}")
+        found = [False] * len(candidates)
+
+    memory_ids: List[Optional[str]] = [None] * len(memories)
+    records = []
+    for i, exists in zip(candidates, found):
+        if exists:
+            continue
+
+        memory = memories[i]
+        memory_ids[i] = str(ULID())
+        records.append({
+            "user_id": user_id,
+            "content": memory.content,
+            "memory_type": memory.memory_type.value,
+            "metadata": memory.metadata or "{}",
+            "created_at": datetime.now().isoformat(),
+            "memory_id": memory_ids[i],
+            "embedding": embeddings[i],
+            "thread_id": thread_id
+        })
+
+    if records:
+        long_term_memory_index.load(records)
+        memory_cache.invalidate(long_term_memory_index, user_id)
+
+    return memory_ids
+
+
 def store_memory(
     long_term_memory_index: SearchIndex,
     content: str,
@@ -52,35 +286,32 @@ def store_memory(
     thread_id: Optional[str] = None,
     metadata: Optional[str] = None
 ) -> None:
-    if metadata is None:
-        metadata = "{}"
-
-    if similar_memory_exists(
-        long_term_memory_index,
-        content,
-        memory_type,
-        user_id,
-        thread_id
-    ):
-        return
-    
-    embedding = redis_embedding_model.embed_query(content)
-    
-    memory_data = {
-        "user_id": user_id or SYSTEM_USER_ID,
-        "content": content,
-        "memory_type": memory_type.value,
-        "metadata": metadata,
-        "created_at": datetime.now().isoformat(),
-        "memory_id": str(ULID()),
-        "embedding": embedding,
-        "thread_id": thread_id
-    }
-
     try:
-        long_term_memory_index.load([memory_data])
+        store_memories(
+            long_term_memory_index,
+            [Memory(content=content, memory_type=memory_type, metadata=metadata or "{}")],
+            user_id,
+            thread_id
+        )
     except Exception as e:
-        return
+        logger.error(f"Error storing memory of user {user_id}: {e}")
+        raise
+
+
+def record_usage(
+    long_term_memory_index: SearchIndex,
+    user_id: str,
+    memories: List[StoredMemory]
+) -> None:
+    '''
+        Record the retrieval time of the memories, the usage signal of the consolidation expiry
+    '''
+
+    if memories:
+        long_term_memory_index.client.zadd(
+            MemoryCache.usage_key(user_id),
+            {memory.id: time.time() for memory in memories}
+        )
 
 
 def retrieve_memories(
@@ -90,8 +321,22 @@ def retrieve_memories(
     user_id: str = SYSTEM_USER_ID,
     thread_id: Optional[str] = None,
     distance_threshold: float = 0.1,
-    limit: int = 5
+    limit: int = 5,
+    use_cache: bool = True
 ) -> List[StoredMemory]:
+    user_id = user_id or SYSTEM_USER_ID
+
+    cache = None
+    if use_cache:
+        memory_types = memory_type if isinstance(memory_type, list) else [memory_type] if memory_type else []
+        options = (tuple(sorted(mt.value for mt in memory_types)), distance_threshold, limit)
+        cache = memory_cache.session(long_term_memory_index, user_id, thread_id, options)
+
+        cached = cache.get(query)
+        if cached is not None:
+            # Served from the cache, still a use of the memories for the consolidation expiry
+            record_usage(long_term_memory_index, user_id, cached)
+            return list(cached)
 
     vector_query = VectorRangeQuery(
         vector=redis_embedding_model.embed_query(query),
@@ -107,10 +352,11 @@ def retrieve_memories(
         num_results=limit,
         vector_field_name="embedding",
         dialect=2,
-        distance_threshold=distance_threshold
+        distance_threshold=distance_threshold,
+        dtype=query_dtype(long_term_memory_index)
     )
 
-    base_filters = [f"@user_id:{{{user_id or SYSTEM_USER_ID}}}"]
+    base_filters = [f"@user_id:{{{user_id}}}"]
 
     if memory_type:
         if isinstance(memory_type, list):
@@ -142,4 +388,9 @@ def retrieve_memories(
         except Exception as e:
             continue
 
+    record_usage(long_term_memory_index, user_id, memories)
+
+    if cache is not None:
+        cache.put(query, memories)
+
     return memories
\ No newline at end of file
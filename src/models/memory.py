@@ -21,4 +21,18 @@ class StoredMemory(Memory):
 
 
 class Memories:
-    memories: List[Memory]
\ No newline at end of file
+    memories: List[Memory]
+
+
+class ConsolidationReport(BaseModel):
+    users: int = 0
+    memories_before: int = 0
+    memories_after: int = 0
+    clusters_merged: int = 0
+    memories_merged: int = 0
+    memories_expired: int = 0
+    duration_seconds: float = 0.0
+
+    @property
+    def reduction(self) -> float:
+        return 1 - self.memories_after / self.memories_before if self.memories_before else 0.0
\ No newline at end of file
@@ -0,0 +1,285 @@
+import os
+import asyncio
+import re
+import math
+import json
+import hashlib
+import sqlite3
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Literal, Optional, Set, Tuple
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore as BaseVectorStore
+from rag.filters import to_sql
+
+
+# Identifiers such as "resnet-50", "v2.1" or "conv_3x3" are matched whole
+TOKEN_PATTERN = re.compile(r"\w+(?:[-_.]\w+)*")
+PART_PATTERN = re.compile(r"[-_.]")
+
+
+def tokenize(text: str) -> List[str]:
+    '''
+        Lowercased tokens; compound identifiers are indexed both whole and by their parts,
+        so "resnet-50" matches a query for "resnet-50" exactly and a query for "resnet"
+    '''
+
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if PART_PATTERN.search(token):
+            tokens.extend(part for part in PART_PATTERN.split(token) if part)
+
+    return tokens
+
+
+class BM25Index(object):
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        k1: float = 1.5,
+        b: float = 0.75
+    ) -> None:
+        '''
+            Sparse inverted index scored with BM25, kept next to a vector store and updated by the same ingestion.
+            Documents and postings live in SQLite, so opening the index reads nothing but two counters and every
+            add or delete only writes the rows of the documents it touches
+
+            Parameters:
+                path: Optional[str] - The SQLite file of the index, in memory if not given
+                k1: float - The term frequency saturation
+                b: float - The document length normalization
+        '''
+
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.Lock()
+
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, content TEXT, metadata TEXT, length INTEGER);
+            CREATE TABLE IF NOT EXISTS postings (term TEXT, doc_id TEXT, frequency INTEGER, PRIMARY KEY (term, doc_id)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_doc_id ON postings (doc_id);
+            CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value INTEGER);
+        """)
+        self.connection.commit()
+
+        stats = dict(self.connection.execute("SELECT key, value FROM stats"))
+        self.count = stats.get("count", 0)
+        self.total_length = stats.get("total_length", 0)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def save_stats(self) -> None:
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO stats VALUES (?, ?)",
+            [("count", self.count), ("total_length", self.total_length)]
+        )
+        self.connection.commit()
+
+    def _remove(self, ids: List[str]) -> None:
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            removed = self.connection.execute(f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM documents WHERE id IN ({placeholders})", batch).fetchone()
+            self.connection.execute(f"DELETE FROM postings WHERE doc_id IN ({placeholders})", batch)
+            self.connection.execute(f"DELETE FROM documents WHERE id IN ({placeholders})", batch)
+            self.count -= removed[0]
+            self.total_length -= removed[1]
+
+    def add(self, ids: List[str], documents: List[Document]) -> None:
+        # A repeated id keeps its last document
+        unique = dict(zip(ids, documents))
+        with self.lock:
+            self._remove(list(unique))
+
+            for doc_id, document in unique.items():
+                terms = Counter(tokenize(document.page_content))
+                length = sum(terms.values())
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)",
+                    (doc_id, document.page_content, json.dumps(document.metadata), length)
+                )
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO postings VALUES (?, ?, ?)",
+                    [(term, doc_id, frequency) for term, frequency in terms.items()]
+                )
+                self.count += 1
+                self.total_length += length
+
+            self.save_stats()
+
+    def delete(self, ids: List[str]) -> None:
+        with self.lock:
+            self._remove(list(ids))
+            self.save_stats()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.connection.executescript("DELETE FROM postings; DELETE FROM documents;")
+            self.count, self.total_length = 0, 0
+            self.save_stats()
+
+    def ids(self) -> Set[str]:
+        with self.lock:
+            return {doc_id for (doc_id,) in self.connection.execute("SELECT id FROM documents")}
+
+    def search(self, query: str, k: int = 10, filter: Optional[dict] = None) -> List[Tuple[Document, float]]:
+        terms = list(set(tokenize(query)))
+
+        with self.lock:
+            if not self.count or not terms:
+                return []
+
+            n_documents = self.count
+            average_length = self.total_length / n_documents
+            placeholders = ",".join("?" * len(terms))
+
+            frequencies = dict(self.connection.execute(
+                f"SELECT term, COUNT(*) FROM postings WHERE term IN ({placeholders}) GROUP BY term", terms
+            ))
+
+            sql = f"SELECT p.term, p.doc_id, p.frequency, d.length FROM postings p JOIN documents d ON d.id = p.doc_id WHERE p.term IN ({placeholders})"
+            parameters: List[Any] = list(terms)
+            if filter:
+                clause, filter_parameters = to_sql(filter, column="d.metadata")
+                sql += f" AND {clause}"
+                parameters.extend(filter_parameters)
+
+            scores: Dict[str, float] = {}
+            for term, doc_id, frequency, length in self.connection.execute(sql, parameters):
+                document_frequency = frequencies[term]
+                idf = math.log(1 + (n_documents - document_frequency + 0.5) / (document_frequency + 0.5))
+                norm = frequency + self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / norm
+
+            top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            if not top:
+                return []
+
+            rows = {
+                doc_id: (content, metadata) for doc_id, content, metadata in self.connection.execute(
+                    f"SELECT id, content, metadata FROM documents WHERE id IN ({','.join('?' * len(top))})",
+                    [doc_id for doc_id, _ in top]
+                )
+            }
+
+        return [
+            (Document(id=doc_id, page_content=rows[doc_id][0], metadata=json.loads(rows[doc_id][1])), score)
+                for doc_id, score in top
+        ]
+
+    def save(self) -> None:
+        # Every write is committed as it happens, kept for the stores that persist explicitly
+        with self.lock:
+            self.connection.commit()
+
+
+def fuse_rankings(
+    rankings: List[List[Tuple[Document, float]]],
+    k: int,
+    fusion: Literal['rrf', 'weighted'] = 'rrf',
+    weights: Optional[List[float]] = None,
+    rrf_k: int = 60
+) -> List[Tuple[Document, float]]:
+    '''
+        Fuse several rankings of (document, score) into one. Documents are matched by content, as
+        not every backend returns the store id
+
+        Parameters:
+            rankings: List[List[Tuple[Document, float]]] - The rankings, best first
+            k: int - The number of fused results
+            fusion: Literal['rrf', 'weighted'] - Reciprocal rank fusion, or a weighted sum of min-max normalized scores
+            weights: Optional[List[float]] - The weight of each ranking, equal by default
+            rrf_k: int - The rank offset of reciprocal rank fusion
+    '''
+
+    weights = weights or [1.0] * len(rankings)
+
+    fused: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for ranking, weight in zip(rankings, weights):
+        if not ranking:
+            continue
+
+        scores = [score for _, score in ranking]
+        low, high = min(scores), max(scores)
+        for rank, (document, score) in enumerate(ranking):
+            key = hashlib.sha1(document.page_content.encode("utf-8")).hexdigest()
+            documents.setdefault(key, document)
+
+            if fusion == 'rrf':
+                contribution = weight / (rrf_k + rank + 1)
+            else:
+                contribution = weight * ((score - low) / (high - low) if high > low else 1.0)
+            fused[key] = fused.get(key, 0.0) + contribution
+
+    top = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    return [(documents[key], score) for key, score in top]
+
+
+class HybridRetriever(BaseRetriever):
+    '''
+        Dense + BM25 retrieval fused in one call. filter is the metadata filter (see rag.filters),
+        dense_kwargs carry it in the form the vector store backend expects
+    '''
+
+    vectorstore: BaseVectorStore
+    sparse_index: Any
+    k: int = 10
+    fetch_k: int = 20
+    fusion: Literal['rrf', 'weighted'] = 'rrf'
+    dense_weight: float = 0.5
+    filter: Optional[dict] = None
+    dense_kwargs: Dict[str, Any] = {}
+
+    def rankings(self, query: str) -> List[List[Tuple[Document, float]]]:
+        return [
+            self.vectorstore.similarity_search_with_relevance_scores(query, k=self.fetch_k, **self.dense_kwargs),
+            self.sparse_index.search(query, k=self.fetch_k, filter=self.filter)
+        ]
+
+    async def arankings(self, query: str) -> List[List[Tuple[Document, float]]]:
+        # The dense and sparse searches are independent, run them concurrently
+        return list(await asyncio.gather(
+            self.vectorstore.asimilarity_search_with_relevance_scores(query, k=self.fetch_k, **self.dense_kwargs),
+            asyncio.to_thread(self.sparse_index.search, query, self.fetch_k, self.filter)
+        ))
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        fused = fuse_rankings(
+            self.rankings(query),
+            self.k,
+            fusion=self.fusion,
+            weights=[self.dense_weight, 1 - self.dense_weight]
+        )
+
+        return [document for document, _ in fused]
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        fused = fuse_rankings(
+            await self.arankings(query),
+            self.k,
+            fusion=self.fusion,
+            weights=[self.dense_weight, 1 - self.dense_weight]
+        )
+
+        return [document for document, _ in fused]
@@ -1,11 +1,17 @@
-from typing import Any, List
-from langchain import hub
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Callable, List, Optional
 from langchain.chains import RetrievalQA
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.runnables import RunnablePassthrough
 from rag.parser import OutputParser
 from rag.loader import DocumentLoader
-from rag.vector_store import VectorStore
+from rag.registry import CollectionRegistry
+from rag.prompts import RAG_PROMPT
+from rag.semantic_cache import SemanticCache, CachedRunnable
+from rag.context_packer import ContextPacker
+from llms.embedding_models import embedding_service
+from loggers.logger import logger
 from config import envConfig
 
 
@@ -18,10 +24,32 @@ class Chain():
             temperature=0.5,
             api_key=envConfig.GOOGLE_API_KEY
         )
-        self.prompt = hub.pull("rlm/rag-prompt")
+        self.prompt = RAG_PROMPT
         self.parser = OutputParser()
+        self.packer = ContextPacker(
+            token_budget=envConfig.CONTEXT_TOKEN_BUDGET,
+            dedup_threshold=envConfig.CONTEXT_DEDUP_THRESHOLD
+        )
+
+    def get_chain(
+        self,
+        com_retrievers: Any,
+        answer_cache: Optional[SemanticCache] = None,
+        retrieval_cache: Optional[SemanticCache] = None
+    ) -> Any:
+        '''
+            Build the RAG chain. It supports invoke/stream and ainvoke/astream; on the async path the
+            retriever runs its dense and BM25 searches concurrently and the LLM call does not hold a thread
+
+            Parameters:
+                com_retrievers: Any - The retriever
+                answer_cache: Optional[SemanticCache] - Caches whole answers, a hit skips retrieval and the LLM
+                retrieval_cache: Optional[SemanticCache] - Caches retrieved documents, a hit skips retrieval only
+        '''
+
+        if retrieval_cache is not None:
+            com_retrievers = CachedRunnable(com_retrievers, retrieval_cache)
 
-    def get_chain(self, com_retrievers: Any) -> Any:
         input_data = {
             "context": com_retrievers | self.format_docs,
             "question": RunnablePassthrough()
@@ -34,6 +62,9 @@ class Chain():
             | self.parser
         )
 
+        if answer_cache is not None:
+            rag_chain = CachedRunnable(rag_chain, answer_cache)
+
         return rag_chain
 
     def get_qa_chain(self, com_retriever: Any) -> Any:
@@ -47,19 +78,13 @@ class Chain():
 
     def format_docs(self, docs: List[Any]) -> str:
         """
-        Format documents into a single string
+        Format documents into a single string, deduplicated, merged and cut to the context token budget
         """
+        docs = self.packer.pack(docs or [])
         if not docs:
             return "No relevant documents found."
-        
-        formatted_docs = []
-        for doc in docs:
-            if hasattr(doc, 'page_content'):
-                formatted_docs.append(doc.page_content)
-            elif isinstance(doc, str):
-                formatted_docs.append(doc)
-            elif isinstance(doc, dict) and 'page_content' in doc:
-                formatted_docs.append(doc['page_content'])
+
+        formatted_docs = [doc.page_content for doc in docs]
         
         return "\n\n".join(formatted_docs) 
 
@@ -68,17 +93,120 @@ def build_rag_chain():
     Build and return a RAG chain. This is a stub; you should implement the actual retriever logic as needed.
     """
     
-    documents = DocumentLoader().load_documents("data/")
+    # Topic collections from COLLECTIONS_FILE, the "Computer_Vision" collection over data/ by default
+    registry = CollectionRegistry.from_file(envConfig.COLLECTIONS_FILE)
+    registry.ingest(loader=DocumentLoader())
 
-    com_retrievers = VectorStore(
-        name="Computer_Vision", 
-        documents=documents,
-        storedb='chroma'
-    ).get_compression_retriever()
-    
-    chain = Chain().get_chain(com_retrievers) 
+    com_retrievers = registry.get_compression_retriever()
+
+    # Retrieval caching by default: a near-duplicate question reuses the retrieved documents but still
+    # gets its own answer. Answer caching is opt-in, it can serve another question's answer
+    caches = {}
+    if envConfig.SEMANTIC_CACHE_MODE in ("answer", "retrieval"):
+        caches[f"{envConfig.SEMANTIC_CACHE_MODE}_cache"] = SemanticCache(
+            embedding_service,
+            threshold=envConfig.SEMANTIC_CACHE_THRESHOLD,
+            ttl_seconds=envConfig.SEMANTIC_CACHE_TTL,
+            max_entries=envConfig.SEMANTIC_CACHE_SIZE,
+            version=lambda: registry.version,
+            name=envConfig.SEMANTIC_CACHE_MODE
+        )
+
+    chain = Chain().get_chain(com_retrievers, **caches)
 
     return chain   
 
 
-chain = build_rag_chain()
\ No newline at end of file
+class LazyChain():
+    def __init__(
+        self,
+        builder: Callable[[], Any]
+    ) -> None:
+        '''
+            Builds a chain once per process on first use, optionally in a background thread
+
+            Parameters:
+                builder: Callable[[], Any] - The function building the chain
+        '''
+
+        self.builder = builder
+        self.chain: Optional[Any] = None
+        self.error: Optional[BaseException] = None
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def status(self) -> str:
+        '''
+            One of "idle", "building", "ready" or "failed", for the UI to display
+        '''
+
+        if self.chain is not None:
+            return "ready"
+        if self.error is not None:
+            return "failed"
+        if self.lock.locked():
+            return "building"
+        return "idle"
+
+    def get(self) -> Any:
+        '''
+            Return the chain, building it (or waiting for the warm-up thread) if needed
+        '''
+
+        if self.chain is None:
+            with self.lock:
+                if self.chain is None:
+                    try:
+                        logger.info("Building RAG chain")
+                        self.chain = self.builder()
+                        self.error = None
+                    except Exception as e:
+                        logger.error(f"Error building RAG chain: {e}")
+                        self.error = e
+                        raise
+
+        return self.chain
+
+    async def aget(self) -> Any:
+        '''
+            Return the chain without blocking the event loop while it is built
+        '''
+
+        if self.chain is not None:
+            return self.chain
+
+        return await asyncio.to_thread(self.get)
+
+    async def ainvoke(self, input: Any, config: Optional[Any] = None, **kwargs: Any) -> Any:
+        chain = await self.aget()
+        return await chain.ainvoke(input, config, **kwargs)
+
+    async def astream(self, input: Any, config: Optional[Any] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        chain = await self.aget()
+        async for chunk in chain.astream(input, config, **kwargs):
+            yield chunk
+
+    def __getattr__(self, name: str) -> Any:
+        # Behaves like the built chain (invoke, stream, ...), building it on first access
+        return getattr(self.get(), name)
+
+    def warm_up(self) -> None:
+        '''
+            Start building the chain in a daemon thread, no-op if it is built or already building
+        '''
+
+        if self.chain is not None or (self.thread and self.thread.is_alive()):
+            return
+
+        def build() -> None:
+            try:
+                self.get()
+            except Exception:
+                pass
+
+        self.thread = threading.Thread(target=build, name="rag-chain-warm-up", daemon=True)
+        self.thread.start()
+
+
+chain = LazyChain(build_rag_chain)
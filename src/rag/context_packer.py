@@ -0,0 +1,193 @@
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from langchain_core.documents import Document
+from loggers.logger import logger
+
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text, close enough to budget a prompt without a tokenizer
+    return (len(text) + 3) // 4
+
+
+def shingles(text: str, size: int = 3) -> Set[Tuple[str, ...]]:
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)}
+
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def to_document(doc: Any) -> Optional[Document]:
+    if isinstance(doc, Document):
+        return doc
+    if hasattr(doc, 'page_content'):
+        return Document(page_content=doc.page_content, metadata=dict(getattr(doc, 'metadata', {}) or {}))
+    if isinstance(doc, str):
+        return Document(page_content=doc)
+    if isinstance(doc, dict) and 'page_content' in doc:
+        return Document(page_content=doc['page_content'], metadata=dict(doc.get('metadata') or {}))
+
+    return None
+
+
+class ContextPacker(object):
+    def __init__(
+        self,
+        token_budget: int = 2000,
+        dedup_threshold: float = 0.9,
+        length_function: Callable[[str], int] = estimate_tokens,
+        min_overlap: int = 20
+    ) -> None:
+        '''
+            Packs retrieved documents into a bounded prompt context: near-duplicate chunks are dropped,
+            overlapping or adjacent chunks of the same page are merged, and the most relevant documents
+            are kept until the token budget is filled
+
+            Parameters:
+                token_budget: int - The maximum number of context tokens
+                dedup_threshold: float - The word 3-gram Jaccard similarity above which two chunks are duplicates
+                length_function: Callable[[str], int] - Counts the tokens of a text
+                min_overlap: int - The minimum number of shared characters to merge chunks without offsets
+        '''
+
+        self.token_budget = token_budget
+        self.dedup_threshold = dedup_threshold
+        self.length_function = length_function
+        self.min_overlap = min_overlap
+        self.lock = threading.Lock()
+
+        self.queries = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queries": self.queries,
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "tokens_saved": self.tokens_in - self.tokens_out,
+            "tokens_saved_per_query": (self.tokens_in - self.tokens_out) / self.queries if self.queries else 0.0,
+        }
+
+    @staticmethod
+    def relevance(document: Document, rank: int) -> float:
+        # Reranked documents carry a relevance score, otherwise keep the retrieval order
+        score = document.metadata.get("relevance_score")
+        return float(score) if score is not None else -float(rank)
+
+    def deduplicate(self, documents: List[Tuple[Document, float]]) -> List[Tuple[Document, float]]:
+        kept: List[Tuple[Document, float, Set[Tuple[str, ...]]]] = []
+        for document, score in sorted(documents, key=lambda item: item[1], reverse=True):
+            grams = shingles(document.page_content)
+            duplicate = False
+            for other, _, other_grams in kept:
+                if document.page_content in other.page_content:
+                    duplicate = True
+                elif grams and other_grams:
+                    duplicate = len(grams & other_grams) / len(grams | other_grams) >= self.dedup_threshold
+                if duplicate:
+                    break
+
+            if not duplicate:
+                kept.append((document, score, grams))
+
+        return [(document, score) for document, score, _ in kept]
+
+    def join(self, first: Document, second: Document) -> Optional[str]:
+        '''
+            The text of first followed by second without the part they share, None if they are not adjacent
+        '''
+
+        start, other_start = first.metadata.get("start_index"), second.metadata.get("start_index")
+        if start is not None and other_start is not None:
+            end = start + len(first.page_content)
+            if other_start > end + 1:
+                return None
+            if other_start > end:
+                # The splitter strips the whitespace between adjacent chunks, put a separator back
+                return first.page_content + " " + second.page_content
+            return first.page_content + second.page_content[end - other_start:]
+
+        # Without offsets, look for a suffix of first that starts second (the splitter's chunk overlap)
+        a, b = first.page_content, second.page_content
+        if len(b) < self.min_overlap:
+            return None
+
+        position = a.find(b[:self.min_overlap])
+        while position != -1:
+            if b.startswith(a[position:]):
+                return a[:position] + b
+            position = a.find(b[:self.min_overlap], position + 1)
+
+        return None
+
+    def merge_adjacent(self, documents: List[Tuple[Document, float]]) -> List[Tuple[Document, float]]:
+        groups: Dict[Tuple[Any, Any], List[Tuple[Document, float]]] = {}
+        for document, score in documents:
+            key = (document.metadata.get("source"), document.metadata.get("page"))
+            groups.setdefault(key, []).append((document, score))
+
+        merged = []
+        for key, group in groups.items():
+            if key == (None, None) or len(group) == 1:
+                merged.extend(group)
+                continue
+
+            group.sort(key=lambda item: item[0].metadata.get("start_index", 0))
+            current, current_score = group[0]
+            for document, score in group[1:]:
+                text = self.join(current, document) or self.join(document, current)
+                if text is None:
+                    merged.append((current, current_score))
+                    current, current_score = document, score
+                    continue
+
+                metadata = {**current.metadata, "relevance_score": max(current_score, score)}
+                if "start_index" in current.metadata and "start_index" in document.metadata:
+                    metadata["start_index"] = min(current.metadata["start_index"], document.metadata["start_index"])
+                current, current_score = Document(page_content=text, metadata=metadata), max(current_score, score)
+            merged.append((current, current_score))
+
+        return merged
+
+    def pack(self, docs: List[Any]) -> List[Document]:
+        '''
+            Return the documents to put in the prompt, most relevant first
+
+            Parameters:
+                docs: List[Any] - Documents, strings or dicts with a page_content, in retrieval order
+        '''
+
+        documents = [document for document in map(to_document, docs) if document is not None]
+        scored = [(document, self.relevance(document, rank)) for rank, document in enumerate(documents)]
+        tokens_in = sum(self.length_function(document.page_content) for document in documents)
+
+        scored = self.merge_adjacent(self.deduplicate(scored))
+        scored.sort(key=lambda item: item[1], reverse=True)
+
+        packed, used = [], 0
+        for document, _ in scored:
+            tokens = self.length_function(document.page_content)
+            if used + tokens <= self.token_budget:
+                packed.append(document)
+                used += tokens
+            elif not packed:
+                # Never return an empty context, cut the most relevant document to the budget
+                ratio = self.token_budget / max(tokens, 1)
+                packed.append(Document(page_content=document.page_content[:int(len(document.page_content) * ratio)], metadata=document.metadata))
+                used = self.token_budget
+
+        with self.lock:
+            self.queries += 1
+            self.tokens_in += tokens_in
+            self.tokens_out += used
+
+        if tokens_in > used:
+            logger.info(f"Context packed from {len(documents)} documents / {tokens_in} tokens to {len(packed)} / {used} tokens")
+
+        return packed
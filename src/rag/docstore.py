@@ -0,0 +1,84 @@
+import os
+import json
+import zlib
+import sqlite3
+import threading
+from typing import Iterator, List, Optional, Sequence, Tuple
+from langchain_core.documents import Document
+from langchain_core.stores import BaseStore
+
+
+class SQLiteDocStore(BaseStore[str, Document]):
+    def __init__(
+        self,
+        path: str,
+        compression_level: int = 6
+    ) -> None:
+        '''
+            Persistent document store for the parent documents of a multi-vector retriever. Documents are
+            kept on disk as zlib-compressed JSON blobs indexed by id, so only the parents of the retrieved
+            chunks are read into memory, and the store survives restarts
+
+            Parameters:
+                path: str - The SQLite database file
+                compression_level: int - The zlib compression level
+        '''
+
+        self.path = path
+        self.compression_level = compression_level
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, data BLOB)")
+        self.connection.commit()
+
+    def encode(self, document: Document) -> bytes:
+        data = json.dumps({"page_content": document.page_content, "metadata": document.metadata})
+        return zlib.compress(data.encode("utf-8"), self.compression_level)
+
+    @staticmethod
+    def decode(doc_id: str, blob: bytes) -> Document:
+        data = json.loads(zlib.decompress(blob).decode("utf-8"))
+        return Document(id=doc_id, page_content=data["page_content"], metadata=data["metadata"])
+
+    def mget(self, keys: Sequence[str]) -> List[Optional[Document]]:
+        found = {}
+        with self.lock:
+            # SQLite limits the number of bound parameters, query in slices
+            for start in range(0, len(keys), 500):
+                batch = list(keys[start:start + 500])
+                placeholders = ",".join("?" * len(batch))
+                found.update(self.connection.execute(f"SELECT id, data FROM documents WHERE id IN ({placeholders})", batch))
+
+        return [self.decode(key, found[key]) if key in found else None for key in keys]
+
+    def mset(self, key_value_pairs: Sequence[Tuple[str, Document]]) -> None:
+        rows = [(key, self.encode(document)) for key, document in key_value_pairs]
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO documents VALUES (?, ?)", rows)
+            self.connection.commit()
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        with self.lock:
+            self.connection.executemany("DELETE FROM documents WHERE id = ?", [(key,) for key in keys])
+            self.connection.commit()
+
+    def yield_keys(self, *, prefix: Optional[str] = None) -> Iterator[str]:
+        with self.lock:
+            if prefix:
+                keys = [key for (key,) in self.connection.execute("SELECT id FROM documents WHERE id LIKE ? || '%'", (prefix,))]
+            else:
+                keys = [key for (key,) in self.connection.execute("SELECT id FROM documents")]
+
+        yield from keys
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def reset(self) -> None:
+        with self.lock:
+            self.connection.execute("DELETE FROM documents")
+            self.connection.commit()
@@ -0,0 +1,324 @@
+import os
+import json
+import threading
+from uuid import uuid4
+from typing import Any, Dict, Iterable, List, Literal, Optional, Tuple
+import numpy as np
+import faiss
+from langchain.vectorstores import FAISS
+from langchain.docstore import InMemoryDocstore
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_community.vectorstores.utils import DistanceStrategy
+from loggers.logger import logger
+
+
+IndexType = Literal['flat', 'ivf_pq', 'hnsw']
+
+
+def build_faiss_index(
+    dim: int,
+    index_type: IndexType = 'flat',
+    n_vectors: Optional[int] = None,
+    nlist: int = 1024,
+    pq_m: int = 16,
+    pq_bits: int = 8,
+    hnsw_m: int = 32,
+    ef_construction: int = 200,
+    refine: bool = False
+) -> faiss.Index:
+    '''
+        Create an empty inner product index (cosine on normalized vectors)
+
+        Parameters:
+            dim: int - The dimension of the vectors
+            index_type: IndexType - 'flat' (exact), 'ivf_pq' (inverted lists of product-quantized codes) or 'hnsw' (graph)
+            n_vectors: Optional[int] - The number of training vectors, caps the number of IVF lists
+            nlist: int - The number of IVF lists
+            pq_m: int - The number of PQ sub-quantizers, must divide dim
+            pq_bits: int - The bits per PQ code
+            hnsw_m: int - The number of HNSW neighbours per node
+            ef_construction: int - The HNSW construction beam width
+            refine: bool - Keep the float vectors and rescore the approximate candidates exactly (IndexRefineFlat)
+    '''
+
+    if index_type == 'flat':
+        return faiss.IndexFlatIP(dim)
+
+    if index_type == 'ivf_pq':
+        if n_vectors is not None:
+            # faiss wants ~39 training points per list
+            nlist = max(1, min(nlist, n_vectors // 39))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_bits, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+    else:
+        raise ValueError(f"Invalid FAISS index type: {index_type}")
+
+    return faiss.IndexRefineFlat(index) if refine else index
+
+
+class TunableFAISS(FAISS):
+    def __init__(
+        self,
+        embedding_function: Embeddings,
+        index: faiss.Index,
+        docstore: InMemoryDocstore,
+        index_to_docstore_id: Dict[int, str],
+        index_type: IndexType = 'flat',
+        index_kwargs: Optional[Dict[str, Any]] = None,
+        nprobe: int = 16,
+        ef_search: int = 64,
+        train_size: int = 50_000,
+        refine_k_factor: int = 4,
+        **kwargs: Any
+    ) -> None:
+        '''
+            FAISS store with a selectable index. IVF-PQ indexes are trained on the first train_size
+            vectors (documents added before that are buffered), and nprobe/ef_search can be
+            overridden per query through the search kwargs
+
+            Parameters:
+                index_type: IndexType - The type of the index, see build_faiss_index
+                index_kwargs: Optional[Dict[str, Any]] - Extra build_faiss_index arguments
+                nprobe: int - The default number of IVF lists visited per query
+                ef_search: int - The default HNSW search beam width
+                train_size: int - The number of vectors collected before training an IVF-PQ index
+                refine_k_factor: int - With index_kwargs refine=True, the number of candidates per result rescored
+        '''
+
+        kwargs.setdefault("normalize_L2", True)
+        kwargs.setdefault("distance_strategy", DistanceStrategy.MAX_INNER_PRODUCT)
+        super().__init__(embedding_function, index, docstore, index_to_docstore_id, **kwargs)
+
+        self.index_type = index_type
+        # The type of the current index, flat while an IVF-PQ store has too few vectors to train on
+        self.built_index_type = index_type
+        self.index_kwargs = index_kwargs or {}
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.train_size = train_size
+        self.refine_k_factor = refine_k_factor
+        self.pending: List[Tuple[str, List[float], dict, str]] = []
+        self.search_lock = threading.Lock()
+
+    @classmethod
+    def open_or_create(
+        cls,
+        folder_path: str,
+        embedding: Embeddings,
+        index_type: IndexType = 'flat',
+        **kwargs: Any
+    ) -> "TunableFAISS":
+        '''
+            Load the store saved in folder_path, or create an empty one
+        '''
+
+        config_path = os.path.join(folder_path, "index_config.json")
+        if os.path.exists(config_path):
+            with open(config_path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+
+            if config["index_type"] == index_type:
+                store = cls.load_local(
+                    folder_path,
+                    embedding,
+                    allow_dangerous_deserialization=True,
+                    index_type=index_type,
+                    **kwargs
+                )
+                store.folder_path = folder_path
+                store.built_index_type = config.get("built_index_type", index_type)
+
+                return store
+
+            logger.info(f"FAISS index type changed from {config['index_type']} to {index_type}, creating a new index")
+
+        dim = len(embedding.embed_query("dimension probe"))
+        index = build_faiss_index(dim, index_type, **(kwargs.get("index_kwargs") or {}))
+        store = cls(embedding, index, InMemoryDocstore({}), {}, index_type=index_type, **kwargs)
+        store.folder_path = folder_path
+
+        return store
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+
+        return self.add_embeddings(zip(texts, self._embed_documents(texts)), metadatas=metadatas, ids=ids)
+
+    def add_embeddings(
+        self,
+        text_embeddings: Iterable[Tuple[str, List[float]]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any
+    ) -> List[str]:
+        if self.index.is_trained:
+            ids = super().add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+
+            # A flat fallback grown to the training size is rebuilt as the requested index, unless the
+            # training size itself is too small to train on
+            trainable = self.train_size >= 2 ** self.index_kwargs.get("pq_bits", 8)
+            if self.built_index_type != self.index_type and trainable and self.index.ntotal >= self.train_size:
+                self.rebuild(list(self.index_to_docstore_id))
+
+            return ids
+
+        texts, embeddings = zip(*text_embeddings)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid4()) for _ in texts]
+        self.pending.extend(zip(texts, embeddings, metadatas, ids))
+
+        if len(self.pending) >= self.train_size:
+            self.flush()
+
+        return list(ids)
+
+    def new_index(self, vectors: np.ndarray) -> faiss.Index:
+        '''
+            An empty index of index_type trained on a sample of the vectors, flat if there are too few
+            vectors to train IVF-PQ on
+        '''
+
+        n_train = min(len(vectors), self.train_size)
+        if self.index_type == 'ivf_pq' and n_train < 2 ** self.index_kwargs.get("pq_bits", 8):
+            logger.info(f"Only {n_train} vectors to train IVF-PQ on, using a flat index")
+            self.built_index_type = 'flat'
+            return build_faiss_index(vectors.shape[1], 'flat')
+
+        index = build_faiss_index(vectors.shape[1], self.index_type, n_vectors=n_train, **self.index_kwargs)
+        if not index.is_trained:
+            logger.info(f"Training {self.index_type} FAISS index on {n_train} vectors")
+            index.train(vectors[np.random.default_rng(0).permutation(len(vectors))[:n_train]])
+        self.built_index_type = self.index_type
+
+        return index
+
+    def rebuild(self, keep: List[int]) -> None:
+        '''
+            Replace the index with a new one holding the vectors of the kept labels, renumbered in order
+        '''
+
+        vectors = self.index.reconstruct_n(0, self.index.ntotal)[keep]
+        index = self.new_index(vectors)
+        index.add(vectors)
+
+        self.index = index
+        self.index_to_docstore_id = {i: self.index_to_docstore_id[old] for i, old in enumerate(keep)}
+
+    def flush(self) -> None:
+        '''
+            Train the index on the buffered vectors (rebuilding it with a number of lists that suits
+            the sample size) and add them
+        '''
+
+        if not self.pending:
+            return
+
+        texts, embeddings, metadatas, ids = zip(*self.pending)
+        self.pending = []
+
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        faiss.normalize_L2(vectors)
+
+        if not self.index.is_trained:
+            self.index = self.new_index(vectors)
+
+        super().add_embeddings(zip(texts, vectors.tolist()), metadatas=list(metadatas), ids=list(ids))
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        pending_ids = set(ids or []).intersection(pending_id for *_, pending_id in self.pending)
+        self.pending = [item for item in self.pending if item[3] not in pending_ids]
+        ids = [doc_id for doc_id in ids or [] if doc_id not in pending_ids]
+        if not ids:
+            return True
+
+        # Checked before the index is touched, so a failed delete leaves the store consistent
+        missing_ids = set(ids).difference(self.index_to_docstore_id.values())
+        if missing_ids:
+            raise ValueError(f"Some specified ids do not exist in the current store. Ids not found: {missing_ids}")
+
+        index = faiss.downcast_index(self.index)
+        if isinstance(index, faiss.IndexFlat):
+            # Flat removal shifts the later vectors down, like FAISS.delete renumbers the mapping
+            return super().delete(ids)
+
+        removed = set(ids)
+        keep = [i for i, doc_id in sorted(self.index_to_docstore_id.items()) if doc_id not in removed]
+
+        if isinstance(index, faiss.IndexIVF):
+            # IVF removal keeps the labels of the remaining vectors, re-add them with consecutive labels. The
+            # trained quantizers are kept: the stored codes are decoded and encoded again
+            index.make_direct_map()
+            vectors = index.reconstruct_n(0, index.ntotal)[keep]
+            index.reset()
+            index.add(vectors)
+            self.index_to_docstore_id = {i: self.index_to_docstore_id[old] for i, old in enumerate(keep)}
+        else:
+            # HNSW graphs and refined indexes do not support removal, rebuild from the stored vectors
+            self.rebuild(keep)
+        self.docstore.delete(ids)
+
+        return True
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Any] = None,
+        fetch_k: int = 20,
+        **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        nprobe = kwargs.pop("nprobe", self.nprobe)
+        ef_search = kwargs.pop("ef_search", self.ef_search)
+        refine_k_factor = kwargs.pop("refine_k_factor", self.refine_k_factor)
+
+        with self.search_lock:
+            index = faiss.downcast_index(self.index)
+            if isinstance(index, faiss.IndexRefine):
+                index.k_factor = refine_k_factor
+                index = faiss.downcast_index(index.base_index)
+
+            if isinstance(index, faiss.IndexIVF):
+                index.nprobe = nprobe
+            elif isinstance(index, faiss.IndexHNSW):
+                index.hnsw.efSearch = max(ef_search, k)
+
+            return super().similarity_search_with_score_by_vector(embedding, k, filter=filter, fetch_k=fetch_k, **kwargs)
+
+    def reset_collection(self) -> None:
+        self.pending = []
+        self.index = build_faiss_index(self.index.d, self.index_type, **self.index_kwargs)
+        self.built_index_type = self.index_type
+        self.docstore = InMemoryDocstore({})
+        self.index_to_docstore_id = {}
+
+        for file_name in ["index.faiss", "index.pkl", "index_config.json"]:
+            file_path = os.path.join(getattr(self, "folder_path", ""), file_name)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def __len__(self) -> int:
+        return len(self.index_to_docstore_id) + len(self.pending)
+
+    def persist(self, folder_path: Optional[str] = None) -> None:
+        '''
+            Flush buffered vectors and save the index, docstore and index config
+        '''
+
+        self.flush()
+
+        folder_path = folder_path or self.folder_path
+        self.save_local(folder_path)
+        with open(os.path.join(folder_path, "index_config.json"), "w", encoding="utf-8") as f:
+            json.dump({"index_type": self.index_type, "built_index_type": self.built_index_type, "index_kwargs": self.index_kwargs}, f)
@@ -0,0 +1,135 @@
+import re
+import operator
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+# Metadata filters use one Mongo-style syntax for every backend, e.g.
+#     {"source": "data/resnet.pdf"}
+#     {"source": {"$in": ["a.pdf", "b.pdf"]}, "ingested_at": {"$gte": 1700000000}}
+#     {"$or": [{"page": 0}, {"page": {"$gt": 10}}]}
+# Several fields (or several operators on one field) are combined with "$and"
+
+
+COMPARISONS: Dict[str, Callable[[Any, Any], bool]] = {
+    "$eq": operator.eq,
+    "$ne": operator.ne,
+    "$gt": operator.gt,
+    "$gte": operator.ge,
+    "$lt": operator.lt,
+    "$lte": operator.le,
+    "$in": lambda value, options: value in options,
+    "$nin": lambda value, options: value not in options,
+}
+
+SQL_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+# Field names safe to inline in a JSON path
+FIELD_PATTERN = re.compile(r"\w+")
+
+
+def conditions(filter: Dict[str, Any]) -> List[Tuple[str, str, Any]]:
+    '''
+        Flatten the field conditions of a filter level into (field, operator, value)
+    '''
+
+    flat = []
+    for field, condition in filter.items():
+        if field in ("$and", "$or"):
+            continue
+        if isinstance(condition, dict):
+            flat.extend((field, op, value) for op, value in condition.items())
+        else:
+            flat.append((field, "$eq", condition))
+
+    return flat
+
+
+def matches(metadata: Dict[str, Any], filter: Optional[Dict[str, Any]]) -> bool:
+    '''
+        Evaluate a filter against the metadata of a document
+    '''
+
+    if not filter:
+        return True
+
+    for field, op, value in conditions(filter):
+        if op not in COMPARISONS:
+            raise ValueError(f"Invalid filter operator: {op}")
+        if field not in metadata:
+            if op in ("$ne", "$nin"):
+                continue
+            return False
+        try:
+            if not COMPARISONS[op](metadata[field], value):
+                return False
+        except TypeError:
+            return False
+
+    if "$and" in filter and not all(matches(metadata, sub_filter) for sub_filter in filter["$and"]):
+        return False
+    if "$or" in filter and not any(matches(metadata, sub_filter) for sub_filter in filter["$or"]):
+        return False
+
+    return True
+
+
+def to_chroma_filter(filter: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+        Chroma accepts a single field or operator per level, wrap the rest in "$and"
+    '''
+
+    clauses = [{field: {op: value}} for field, op, value in conditions(filter)]
+    for logical in ("$and", "$or"):
+        if logical in filter:
+            clauses.append({logical: [to_chroma_filter(sub_filter) for sub_filter in filter[logical]]})
+
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def json_path(field: str, column: str = "metadata") -> Tuple[str, List[Any]]:
+    '''
+        The SQLite expression of a metadata field, returns (expression, parameters). Plain field names are
+        inlined, so the query matches the expression indexes, any other name is bound as a parameter
+    '''
+
+    if FIELD_PATTERN.fullmatch(field):
+        return f"json_extract({column}, '$.\"{field}\"')", []
+
+    # SQLite path labels have no escape for a double quote, such a field is kept valid and matches nothing
+    return f"json_extract({column}, ?)", ['$."' + field.replace('"', '\\"') + '"']
+
+
+def to_sql(filter: Dict[str, Any], column: str = "metadata") -> Tuple[str, List[Any]]:
+    '''
+        Translate a filter into a SQLite WHERE clause over a JSON column, returns (clause, parameters)
+    '''
+
+    clauses, parameters = [], []
+    for field, op, value in conditions(filter):
+        path, path_parameters = json_path(field, column)
+        if op in ("$in", "$nin"):
+            placeholders = ",".join("?" * len(value))
+            clause = f"{path} {'IN' if op == '$in' else 'NOT IN'} ({placeholders})"
+            values = list(value)
+        elif op in SQL_OPERATORS:
+            clause = f"{path} {SQL_OPERATORS[op]} ?"
+            values = [value]
+        else:
+            raise ValueError(f"Invalid filter operator: {op}")
+
+        if op in ("$ne", "$nin"):
+            # Like matches, a missing field satisfies a negation, where SQL would compare NULL
+            clauses.append(f"({path} IS NULL OR {clause})")
+            parameters.extend(path_parameters + path_parameters + values)
+        else:
+            clauses.append(clause)
+            parameters.extend(path_parameters + values)
+
+    for logical, joiner in (("$and", " AND "), ("$or", " OR ")):
+        if logical in filter:
+            sub_clauses = [to_sql(sub_filter, column) for sub_filter in filter[logical]]
+            clauses.append("(" + joiner.join(clause for clause, _ in sub_clauses) + ")")
+            for _, sub_parameters in sub_clauses:
+                parameters.extend(sub_parameters)
+
+    return " AND ".join(clauses) or "1", parameters
@@ -1,11 +1,12 @@
 import os
-import re
-from typing import Dict, Any, List
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, List, Iterable, Iterator, Tuple, Callable, Optional
 # from itertools import chain
 # from tqdm import tqdm
 from langchain.schema import Document
-from langchain.document_loaders.pdf import PyPDFDirectoryLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from pypdf import PdfReader
 # from unstructured.partition.pdf import partition_pdf
 # from unstructured.partition.docx import partition_docx
 # from unstructured.partition.text import partition_text
@@ -15,6 +16,7 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 # from enums.data_element_type import DataElementType
 # from models.data_element import DataElement
 from loggers.logger import logger
+from rag.splitter import FastTextSplitter, clean_text
 
 
 # class DocumentLoader(object):
@@ -172,6 +174,45 @@ from loggers.logger import logger
 #         return documents
 
 
+def open_pdf(file_path: str) -> PdfReader:
+    reader = PdfReader(file_path)
+    if reader.is_encrypted and not reader.decrypt(""):
+        raise PermissionError(f"PDF is password protected: {file_path}")
+
+    return reader
+
+
+def count_pdf_pages(file_path: str) -> Tuple[int, Optional[str]]:
+    '''
+        Count the pages of a PDF, returns (page count, error)
+    '''
+
+    try:
+        return len(open_pdf(file_path).pages), None
+    except Exception as e:
+        return 0, f"{type(e).__name__}: {e}"
+
+
+def parse_pdf_pages(file_path: str, start: int, end: int) -> Tuple[List[Document], Optional[str]]:
+    '''
+        Extract the text of the pages [start, end) of a PDF, returns (page documents, error).
+        Runs inside worker processes, so it must stay a module level function
+    '''
+
+    try:
+        reader = open_pdf(file_path)
+        pages = [
+            Document(
+                page_content=reader.pages[page].extract_text(),
+                metadata={"source": file_path, "page": page}
+            )
+                for page in range(start, min(end, len(reader.pages)))
+        ]
+        return pages, None
+    except Exception as e:
+        return [], f"{type(e).__name__}: {e}"
+
+
 class DocumentLoader(object):
     def __init__(
         self,
@@ -179,17 +220,25 @@ class DocumentLoader(object):
         split_kwargs: Dict[str, Any] = {
             "chunk_size": 300,
             "chunk_overlap": 0
-        }
+        },
+        num_workers: int = 1,
+        pages_per_task: int = 50
     ) -> None:
         '''
             Parameters:
                 seperators: List[str] - The separators to use for splitting the text
                 split_kwargs: Dict[str, Any] - The keyword arguments to pass to the splitter
+                num_workers: int - The number of worker processes used to parse PDFs, 1 parses in process
+                pages_per_task: int - The number of pages of a large PDF parsed by a single worker task
         '''
 
-        self.splitter = RecursiveCharacterTextSplitter(
+        self.num_workers = max(1, num_workers)
+        self.pages_per_task = pages_per_task
+
+        # Chunks keep the metadata of their page (source, page) plus their offset in it (start_index)
+        self.splitter = FastTextSplitter(
             separators=seperators,
-            **split_kwargs
+            **{"add_start_index": True, **split_kwargs}
         )
 
     def remove_non_utf8_characters(self, text: str) -> str:
@@ -197,31 +246,196 @@ class DocumentLoader(object):
             Remove non-UTF8 characters from text
         '''
 
-        return re.sub(r'[^\x00-\x7F]+', '', text)
+        return clean_text(text)
 
-    def load_documents(self, dir_path: str):
+    def list_files(self, dir_path: str) -> List[str]:
         '''
-            Loads documents from a directory
+            List the PDF files of a directory recursively, in a stable order
 
             Parameters:
                 dir_path: str - The path to the directory containing the files
         '''
-        
+
         if not os.path.exists(dir_path):
             raise FileNotFoundError(f"Directory not found: {dir_path}")
 
-        list_of_files = os.listdir(dir_path)
-        logger.info(f"List of files: {list_of_files}")
+        file_paths = []
+        for root, dirs, files in os.walk(dir_path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            file_paths.extend(
+                os.path.normpath(os.path.join(root, file))
+                    for file in sorted(files)
+                        if file.lower().endswith(".pdf") and not file.startswith(".")
+            )
 
-        # file_paths = [
-        #     os.path.join(dir_path, file)
-        #         for file in list_of_files
-        # ]
-    
-        documents = PyPDFDirectoryLoader(dir_path).load()
-        documents = [Document(page_content=self.remove_non_utf8_characters(document.page_content)) for document in documents]
-        sentences = self.splitter.split_documents(documents)
+        return file_paths
+
+    def map_tasks(
+        self,
+        func: Callable[..., Tuple[Any, Optional[str]]],
+        tasks: List[Tuple]
+    ) -> Iterator[Tuple[Any, Optional[str]]]:
+        '''
+            Run func(*task) for every task and yield the (result, error) pairs in task order.
+            With several workers the tasks run in a process pool; when a worker crashes, the
+            oldest pending task is retried alone so that only the task that crashes again fails
+
+            Parameters:
+                func: Callable - A module level function returning (result, error)
+                tasks: List[Tuple] - The arguments of each call
+        '''
+
+        if self.num_workers == 1:
+            for task in tasks:
+                yield func(*task)
+            return
+
+        position = 0
+        isolate = False
+        while position < len(tasks):
+            workers = 1 if isolate else self.num_workers
+
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = deque()
+                submitted = position
+                try:
+                    while position < len(tasks):
+                        # Bounded window, keeps memory flat while results are yielded in order
+                        while submitted < len(tasks) and len(futures) < workers * 4:
+                            futures.append(executor.submit(func, *tasks[submitted]))
+                            submitted += 1
+
+                        result = futures.popleft().result()
+                        position += 1
+                        yield result
+
+                        if isolate:
+                            isolate = False
+                            break
+                except BrokenProcessPool:
+                    if isolate:
+                        yield None, f"Worker process crashed on task {tasks[position]}"
+                        position += 1
+                    isolate = not isolate
+
+    def parse_files(self, file_paths: List[str]) -> Iterator[Tuple[str, List[Document]]]:
+        '''
+            Parse PDF files into page documents, splitting large files into page ranges.
+            Files are yielded in input order; unreadable, encrypted or crashing files are logged and skipped
+
+            Parameters:
+                file_paths: List[str] - The paths to the PDF files
+        '''
+
+        tasks = []
+        for file_path, (page_count, error) in zip(file_paths, self.map_tasks(count_pdf_pages, [(file_path,) for file_path in file_paths])):
+            if error:
+                logger.error(f"Error processing file {file_path}: {error}")
+                continue
+
+            tasks.extend(
+                (file_path, start, start + self.pages_per_task)
+                    for start in range(0, page_count, self.pages_per_task)
+            )
+
+        current_file, pages, failed = None, [], False
+        for (file_path, _, _), (documents, error) in zip(tasks, self.map_tasks(parse_pdf_pages, tasks)):
+            if file_path != current_file:
+                if current_file is not None and not failed:
+                    yield current_file, pages
+                current_file, pages, failed = file_path, [], False
+
+            if error:
+                logger.error(f"Error processing file {file_path}: {error}")
+                failed = True
+            elif not failed:
+                pages.extend(documents)
+
+        if current_file is not None and not failed:
+            yield current_file, pages
+
+    def clean_document(self, file_path: str, page: Document) -> Document:
+        return Document(
+            page_content=self.remove_non_utf8_characters(page.page_content),
+            metadata={**page.metadata, "source": file_path}
+        )
+
+    def split_pages(self, file_path: str, pages: Iterable[Document]) -> Iterator[Document]:
+        '''
+            Lazily clean and split pages, one page at a time
+        '''
+
+        for page in pages:
+            yield from self.splitter.split_documents([self.clean_document(file_path, page)])
+
+    def iter_documents(self, dir_path: str) -> Iterator[Document]:
+        '''
+            Lazily yields the cleaned pages of every PDF in a directory. At most one file's pages
+            are held in memory at a time
+
+            Parameters:
+                dir_path: str - The path to the directory containing the files
+        '''
+
+        for file_path, pages in self.parse_files(self.list_files(dir_path)):
+            for page in pages:
+                yield self.clean_document(file_path, page)
+
+    def iter_chunks(self, dir_path: str) -> Iterator[Document]:
+        '''
+            Lazily yields the chunks of every PDF in a directory
+
+            Parameters:
+                dir_path: str - The path to the directory containing the files
+        '''
+
+        for document in self.iter_documents(dir_path):
+            yield from self.splitter.split_documents([document])
+
+    def load_files(self, file_paths: List[str]) -> Iterator[Tuple[str, List[Document]]]:
+        '''
+            Loads, cleans and splits PDF files, yielding (file path, chunks) in input order
+
+            Parameters:
+                file_paths: List[str] - The paths to the PDF files
+        '''
+
+        for file_path, pages in self.parse_files(file_paths):
+            yield file_path, list(self.split_pages(file_path, pages))
+
+    def load_file_pages(self, file_paths: List[str]) -> Iterator[Tuple[str, List[Document], List[List[Document]]]]:
+        '''
+            Loads, cleans and splits PDF files, yielding (file path, cleaned pages, chunks of each page)
+            in input order, for stores that keep the pages as parents of their chunks
+
+            Parameters:
+                file_paths: List[str] - The paths to the PDF files
+        '''
+
+        for file_path, pages in self.parse_files(file_paths):
+            pages = [self.clean_document(file_path, page) for page in pages]
+            yield file_path, pages, [self.splitter.split_documents([page]) for page in pages]
+
+    def load_file(self, file_path: str) -> List[Document]:
+        '''
+            Loads, cleans and splits a single PDF file
+
+            Parameters:
+                file_path: str - The path to the PDF file
+        '''
+
+        return next((chunks for _, chunks in self.load_files([file_path])), [])
+
+    def load_documents(self, dir_path: str):
+        '''
+            Loads documents from a directory
+
+            Parameters:
+                dir_path: str - The path to the directory containing the files
+        '''
+        
+        sentences = list(self.iter_chunks(dir_path))
 
         logger.info(f"Documents: {len(sentences)}")
 
-        return sentences
\ No newline at end of file
+        return sentences
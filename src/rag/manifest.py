@@ -0,0 +1,173 @@
+import os
+import json
+import hashlib
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Bumped when the chunk ids or metadata change, collections ingested with an older schema are rebuilt
+SCHEMA_VERSION = 2
+
+
+class IngestionManifest(object):
+    def __init__(
+        self,
+        path: str
+    ) -> None:
+        '''
+            Parameters:
+                path: str - The path of the JSON file the manifest is persisted to
+        '''
+
+        self.path = path
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.embedding_model: Optional[str] = None
+        self.schema_version: Optional[int] = None
+
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.embedding_model = data.get("embedding_model")
+            self.schema_version = data.get("schema_version", 1)
+
+        self.version = self.compute_version()
+
+    @staticmethod
+    def hash_file(file_path: str, block_size: int = 1 << 20) -> str:
+        '''
+            Compute the sha256 of a file without reading it into memory at once
+        '''
+
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                digest.update(block)
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def chunk_ids(file_path: str, chunk_hashes: List[str]) -> List[str]:
+        '''
+            Derive stable chunk ids from the file path and the chunk hashes, so that
+            an unchanged chunk keeps its id even when it moves inside the file
+        '''
+
+        seen: Dict[str, int] = {}
+        ids = []
+        for chunk_hash in chunk_hashes:
+            occurrence = seen.get(chunk_hash, 0)
+            seen[chunk_hash] = occurrence + 1
+            ids.append(hashlib.sha1(f"{file_path}:{chunk_hash}:{occurrence}".encode("utf-8")).hexdigest())
+
+        return ids
+
+    @staticmethod
+    def parent_ids(file_path: str, page_count: int) -> List[str]:
+        '''
+            Ids of the parent (page) documents of a file, one per page position
+        '''
+
+        return [hashlib.sha1(f"{file_path}#page={page}".encode("utf-8")).hexdigest() for page in range(page_count)]
+
+    def diff(self, file_paths: List[str]) -> Tuple[Dict[str, str], List[str]]:
+        '''
+            Compare the files on disk against the manifest
+
+            Parameters:
+                file_paths: List[str] - The files currently present in the corpus
+
+            Returns:
+                changed: Dict[str, str] - New or modified files mapped to their content hash
+                removed: List[str] - Files recorded in the manifest that no longer exist
+        '''
+
+        changed = {}
+        for file_path in file_paths:
+            stat = os.stat(file_path)
+            entry = self.files.get(file_path)
+
+            # Size and mtime match: trust the recorded hash and skip reading the file
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                continue
+
+            file_hash = self.hash_file(file_path)
+            if entry and entry["hash"] == file_hash:
+                entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime
+                continue
+
+            changed[file_path] = file_hash
+
+        current = set(file_paths)
+        removed = [file_path for file_path in self.files if file_path not in current]
+
+        return changed, removed
+
+    def compute_version(self) -> str:
+        '''
+            Hash of the ingested content, changes whenever a file is added, changed or removed
+        '''
+
+        digest = hashlib.sha256(str(self.embedding_model).encode("utf-8"))
+        for file_path in sorted(self.files):
+            digest.update(f"{file_path}:{self.files[file_path]['hash']}".encode("utf-8"))
+
+        return digest.hexdigest()
+
+    def chunk_count(self) -> int:
+        return sum(len(entry["chunk_ids"]) for entry in self.files.values())
+
+    def parent_count(self) -> int:
+        return sum(len(entry.get("parent_ids", [])) for entry in self.files.values())
+
+    def reset(self) -> None:
+        self.files = {}
+        self.embedding_model = None
+        self.schema_version = None
+
+    def get_chunk_ids(self, file_path: str) -> List[str]:
+        entry = self.files.get(file_path)
+        return list(entry["chunk_ids"]) if entry else []
+
+    def get_parent_ids(self, file_path: str) -> List[str]:
+        entry = self.files.get(file_path)
+        return list(entry.get("parent_ids", [])) if entry else []
+
+    def update(
+        self,
+        file_path: str,
+        file_hash: str,
+        chunk_hashes: List[str],
+        chunk_ids: List[str],
+        parent_ids: Optional[List[str]] = None
+    ) -> None:
+        stat = os.stat(file_path)
+        self.files[file_path] = {
+            "hash": file_hash,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "chunk_hashes": chunk_hashes,
+            "chunk_ids": chunk_ids,
+            "parent_ids": parent_ids or [],
+        }
+
+    def remove(self, file_path: str) -> List[str]:
+        entry = self.files.pop(file_path, None)
+        return entry["chunk_ids"] if entry else []
+
+    def save(self) -> None:
+        '''
+            Atomically write the manifest to disk
+        '''
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"embedding_model": self.embedding_model, "schema_version": self.schema_version, "files": self.files}, f)
+        os.replace(tmp_path, self.path)
+
+        self.version = self.compute_version()
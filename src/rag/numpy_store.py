@@ -0,0 +1,629 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import sqlite3
+import threading
+from uuid import uuid4
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Literal, NamedTuple, Optional, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore as BaseVectorStore
+from rag.filters import FIELD_PATTERN, json_path, to_sql
+
+
+INDEXED_FIELDS = ["source", "page", "ingested_at"]
+
+# Number of set bits of every byte, for Hamming distances between packed binary codes
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def popcount(codes: np.ndarray) -> np.ndarray:
+    # NumPy >= 2.0 has a vectorized popcount, older versions use the lookup table
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(codes)
+
+    return POPCOUNT[codes]
+
+
+class Snapshot(NamedTuple):
+    '''
+        Consistent view of the matrix for one search, writers replace these objects instead of resizing them
+    '''
+
+    vectors: Optional[np.memmap]
+    full_vectors: Optional[np.memmap]
+    alive: np.ndarray
+    count: int
+    generation: int
+
+
+class NumpyVectorStore(BaseVectorStore):
+    def __init__(
+        self,
+        persist_directory: str,
+        embedding: Embeddings,
+        dtype: Literal['float32', 'float16', 'int8', 'binary'] = 'float32',
+        block_size: int = 65536,
+        rescore: Optional[bool] = None,
+        rescore_factor: int = 4,
+        compact_ratio: float = 0.3,
+        compact_min_rows: int = 1024
+    ) -> None:
+        '''
+            Exact-search vector store: normalized embeddings live in a memory-mapped matrix on disk and
+            queries are answered with blocked matrix products and argpartition top-k. Opening a store
+            only maps the file, and processes opening the same store share its pages.
+
+            Quantized stores (int8: 4x smaller, binary: 32x smaller) can keep a float32 copy on disk
+            for rescoring: the quantized matrix selects k * rescore_factor candidates, and only their
+            float rows are read back to rank them exactly
+
+            Parameters:
+                persist_directory: str - The directory holding the matrix and the document table
+                embedding: Embeddings - The embedding model
+                dtype: Literal['float32', 'float16', 'int8', 'binary'] - The storage type of the vectors, fixed at creation
+                block_size: int - The number of rows scored per matrix product
+                rescore: Optional[bool] - Keep float32 vectors to rescore candidates, by default for int8 and binary.
+                    Fixed at creation
+                rescore_factor: int - The number of candidates per result rescored
+                compact_ratio: float - The fraction of dead (deleted or replaced) rows that triggers a compaction
+                compact_min_rows: int - The minimum number of dead rows before compacting
+        '''
+
+        self.persist_directory = persist_directory
+        self.embedding = embedding
+        self.block_size = block_size
+        self.rescore_factor = rescore_factor
+        self.compact_ratio = compact_ratio
+        self.compact_min_rows = compact_min_rows
+        self.lock = threading.Lock()
+
+        # The generation is incremented by every compaction, which renumbers the rows and writes new matrix
+        # files, the version by every write. Both are stamped in the meta table, where every process sees them
+        self.generation = 0
+        self.version: Optional[int] = None
+
+        os.makedirs(persist_directory, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(persist_directory, "documents.sqlite3"), check_same_thread=False)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (row INTEGER PRIMARY KEY, id TEXT UNIQUE, text TEXT, metadata TEXT);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+            """
+        )
+        # Metadata fields commonly used to scope searches, filters on them do not scan the table
+        for field in INDEXED_FIELDS:
+            # Inlined in the statement, an index expression cannot take parameters
+            if not FIELD_PATTERN.fullmatch(field):
+                raise ValueError(f"Invalid indexed field name: {field}")
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS documents_{field} ON documents ({json_path(field)[0]})")
+        self.connection.commit()
+
+        meta = dict(self.connection.execute("SELECT name, value FROM meta").fetchall())
+        self.dtype = meta.get("dtype", dtype)
+        if rescore is None:
+            rescore = self.dtype in ('int8', 'binary')
+        self.rescore = meta.get("rescore", str(rescore)) == "True"
+        self.dim: Optional[int] = None
+        self.count = 0
+        self.vectors: Optional[np.memmap] = None
+        self.full_vectors: Optional[np.memmap] = None
+        self.alive = np.zeros(0, dtype=bool)
+        self.ids: Dict[str, int] = {}
+
+        with self.transaction():
+            pass
+
+    @contextmanager
+    def transaction(self, write: bool = False):
+        '''
+            Hold the lock and a SQLite transaction, reloading the state first if another process wrote since.
+            A read transaction sees no commit of other processes, a write one also excludes their writers
+        '''
+
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                version = self.connection.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+                if self.version != (int(version[0]) if version else 0):
+                    self.load()
+                yield
+            except BaseException:
+                self.connection.rollback()
+                # The state may hold uncommitted changes, reload it on the next transaction
+                self.version = None
+                raise
+            else:
+                self.connection.commit()
+
+    def load(self) -> None:
+        meta = dict(self.connection.execute("SELECT name, value FROM meta").fetchall())
+        self.dim = int(meta["dim"]) if "dim" in meta else None
+        self.count = int(meta.get("count", 0))
+        self.generation = int(meta.get("generation", 0))
+        self.version = int(meta.get("version", 0))
+
+        # Rows whose document was deleted or replaced stay in the matrix and are masked out
+        self.ids = dict(self.connection.execute("SELECT id, row FROM documents").fetchall())
+        alive = np.zeros(self.count, dtype=bool)
+        alive[list(self.ids.values())] = True
+        self.alive = alive
+
+        self.vectors, self.full_vectors = None, None
+        if self.dim:
+            self.open_vectors(max(self.count, 1))
+
+    def stamp(self, generation: Optional[int] = None) -> None:
+        # Written last in the transaction of every write, other processes reload on their next transaction
+        self.generation = self.generation if generation is None else generation
+        self.version = (self.version or 0) + 1
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+            [("count", str(self.count)), ("generation", str(self.generation)), ("version", str(self.version))]
+        )
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def open_matrix(self, name: str, dtype: str, width: int, capacity: int) -> np.memmap:
+        path = os.path.join(self.persist_directory, name)
+        size = capacity * width * np.dtype(dtype).itemsize
+        with open(path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+
+        capacity = os.path.getsize(path) // (width * np.dtype(dtype).itemsize)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=(capacity, width))
+
+    def matrix_names(self, generation: int) -> Tuple[str, str]:
+        # The files of a compaction are new ones, suffixed with its generation
+        suffix = f".{generation}" if generation else ""
+        return f"vectors.{self.dtype}{suffix}", f"vectors.rescore.float32{suffix}"
+
+    def open_vectors(self, capacity: int, generation: Optional[int] = None) -> None:
+        name, full_name = self.matrix_names(self.generation if generation is None else generation)
+        if self.dtype == 'binary':
+            # 1 bit per dimension, packed 8 per byte
+            self.vectors = self.open_matrix(name, "uint8", (self.dim + 7) // 8, capacity)
+        else:
+            self.vectors = self.open_matrix(name, self.dtype, self.dim, capacity)
+
+        if self.rescore and self.dtype != 'float32':
+            self.full_vectors = self.open_matrix(full_name, "float32", self.dim, capacity)
+
+    def remove_stale_files(self) -> None:
+        # Matrices of older generations, or of a compaction interrupted before its commit
+        current = self.matrix_names(self.generation)
+        for name in os.listdir(self.persist_directory):
+            if name.startswith("vectors.") and name not in current:
+                try:
+                    os.remove(os.path.join(self.persist_directory, name))
+                except OSError:
+                    # Still mapped on a platform that cannot unlink it, removed by a later compaction
+                    pass
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        if self.dtype == 'binary':
+            return np.packbits(vectors > 0, axis=1)
+
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        if self.dtype == 'int8':
+            return np.round(vectors * 127).astype(np.int8)
+
+        return vectors.astype(self.dtype)
+
+    def decode(self, block: np.ndarray) -> np.ndarray:
+        if self.dtype == 'int8':
+            return block.astype(np.float32) / 127
+
+        return block.astype(np.float32, copy=False)
+
+    def score_block(self, queries: np.ndarray, packed_queries: Optional[np.ndarray], block: np.ndarray) -> np.ndarray:
+        '''
+            Similarity of normalized queries to a block of stored vectors. Binary codes are compared
+            by Hamming distance, mapped to [-1, 1] like a cosine
+        '''
+
+        if self.dtype == 'binary':
+            distances = np.stack([popcount(np.bitwise_xor(block, packed)).sum(axis=1, dtype=np.int32) for packed in packed_queries])
+            return 1 - 2 * distances.astype(np.float32) / self.dim
+
+        return queries @ self.decode(block).T
+
+    def add_embeddings(
+        self,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None
+    ) -> List[str]:
+        ids = list(ids) if ids else [str(uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        matrix = np.asarray(embeddings, dtype=np.float32)
+
+        with self.transaction(write=True):
+            if self.dim is None:
+                self.dim = matrix.shape[1]
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                    [("dim", str(self.dim)), ("dtype", self.dtype), ("rescore", str(self.rescore))]
+                )
+                self.open_vectors(max(len(texts), 1024))
+
+            # Replaced documents: mask the old row, the new version is appended
+            self.mask([doc_id for doc_id in ids if doc_id in self.ids])
+            self.connection.executemany("DELETE FROM documents WHERE id = ?", [(doc_id,) for doc_id in ids])
+
+            start, end = self.count, self.count + len(texts)
+            if end > self.vectors.shape[0]:
+                self.vectors.flush()
+                if self.full_vectors is not None:
+                    self.full_vectors.flush()
+                self.open_vectors(max(end, 2 * self.vectors.shape[0]))
+
+            self.vectors[start:end] = self.encode(matrix)
+            self.vectors.flush()
+            if self.full_vectors is not None:
+                self.full_vectors[start:end] = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+                self.full_vectors.flush()
+
+            self.connection.executemany(
+                "INSERT INTO documents VALUES (?, ?, ?, ?)",
+                [(row, doc_id, text, json.dumps(metadata)) for row, doc_id, text, metadata in zip(range(start, end), ids, texts, metadatas)]
+            )
+
+            self.count = end
+            self.alive = np.concatenate([self.alive, np.ones(len(texts), dtype=bool)])
+            self.ids.update(zip(ids, range(start, end)))
+            self.stamp()
+            self.maybe_compact()
+
+        return ids
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+
+        return self.add_embeddings(texts, self.embedding.embed_documents(texts), metadatas, ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        with self.transaction(write=True):
+            self.mask([doc_id for doc_id in ids or [] if doc_id in self.ids])
+            self.connection.executemany("DELETE FROM documents WHERE id = ?", [(doc_id,) for doc_id in ids or []])
+            self.stamp()
+            self.maybe_compact()
+
+        return True
+
+    def mask(self, ids: List[str]) -> None:
+        # Copied, not written in place, so a search keeps the mask of its snapshot
+        if ids:
+            alive = self.alive.copy()
+            alive[[self.ids.pop(doc_id) for doc_id in ids]] = False
+            self.alive = alive
+
+    def maybe_compact(self) -> None:
+        dead = self.count - len(self.ids)
+        if dead >= self.compact_min_rows and dead > self.compact_ratio * self.count:
+            self._compact()
+
+    def compact(self) -> None:
+        '''
+            Rewrite the matrix with the live rows only, reclaiming the rows of deleted and replaced documents
+        '''
+
+        with self.transaction(write=True):
+            self._compact()
+
+    def _compact(self) -> None:
+        '''
+            Called in a write transaction. The live rows are copied to the files of the next generation, which
+            the renumbered rows and the generation stamp then point to in one commit: a crash before it leaves
+            the previous generation in place, searches and processes still mapping it keep reading it
+        '''
+
+        if self.vectors is None:
+            return
+
+        live = np.asarray(sorted(self.ids.values()), dtype=np.int64)
+        capacity = max(len(live), 1)
+        generation = self.generation + 1
+
+        matrices = [self.vectors] if self.full_vectors is None else [self.vectors, self.full_vectors]
+        for matrix, name in zip(matrices, self.matrix_names(generation)):
+            # Left over by a compaction interrupted before its commit
+            if os.path.exists(os.path.join(self.persist_directory, name)):
+                os.remove(os.path.join(self.persist_directory, name))
+            compacted = self.open_matrix(name, matrix.dtype.str, matrix.shape[1], capacity)
+            for start in range(0, len(live), self.block_size):
+                compacted[start:start + self.block_size] = matrix[live[start:start + self.block_size]]
+            compacted.flush()
+            del compacted
+
+        # Rows only move down and are renumbered in order, so no update collides with a row not yet moved
+        self.connection.executemany("UPDATE documents SET row = ? WHERE row = ?", [(new, int(old)) for new, old in enumerate(live) if new != old])
+        self.count = len(live)
+        self.stamp(generation)
+        self.connection.commit()
+
+        remap = {int(old): new for new, old in enumerate(live)}
+        self.ids = {doc_id: remap[row] for doc_id, row in self.ids.items()}
+        self.alive = np.ones(self.count, dtype=bool)
+        self.open_vectors(capacity)
+        self.remove_stale_files()
+
+    def __len__(self) -> int:
+        with self.transaction():
+            return len(self.ids)
+
+    def reset_collection(self) -> None:
+        with self.transaction(write=True):
+            self.connection.execute("DELETE FROM documents")
+            self.connection.execute("DELETE FROM meta WHERE name NOT IN ('generation', 'version')")
+
+            self.vectors, self.full_vectors = None, None
+            self.dim, self.count = None, 0
+            self.alive = np.zeros(0, dtype=bool)
+            self.ids = {}
+            self.stamp(self.generation + 1)
+            self.connection.commit()
+
+            self.remove_stale_files()
+
+    def snapshot(self) -> Snapshot:
+        with self.transaction():
+            return Snapshot(self.vectors, self.full_vectors, self.alive, self.count, self.generation)
+
+    def documents(self, rows: List[int]) -> Dict[int, Document]:
+        placeholders = ",".join("?" * len(rows))
+        return {
+            row: Document(id=doc_id, page_content=text, metadata=json.loads(metadata))
+                for row, doc_id, text, metadata in self.connection.execute(
+                    f"SELECT row, id, text, metadata FROM documents WHERE row IN ({placeholders})", rows
+                )
+        }
+
+    def get_documents(self, rows: List[int], generation: int) -> Optional[Dict[int, Document]]:
+        '''
+            The documents of the rows still stored, by row, None if the rows were renumbered by a
+            compaction, of any process, since generation
+        '''
+
+        with self.transaction():
+            return self.documents(rows) if generation == self.generation else None
+
+    def get_by_ids(self, ids: List[str]) -> List[Document]:
+        with self.transaction():
+            rows = [self.ids[doc_id] for doc_id in ids if doc_id in self.ids]
+            found = self.documents(rows) if rows else {}
+
+        return [found[row] for row in rows]
+
+    def filter_rows(self, filter: dict) -> np.ndarray:
+        '''
+            The sorted rows of the documents matching a metadata filter, see rag.filters
+        '''
+
+        clause, parameters = to_sql(filter)
+        with self.transaction():
+            rows = [row for (row,) in self.connection.execute(f"SELECT row FROM documents WHERE {clause}", parameters)]
+
+        return np.sort(np.asarray(rows, dtype=np.int64))
+
+    def iter_blocks(self, view: Snapshot, rows: Optional[np.ndarray] = None) -> Iterable[Tuple[np.ndarray, np.ndarray]]:
+        '''
+            Yield (row indices, stored vectors) blocks of the whole matrix, or of the given rows only
+        '''
+
+        if rows is None:
+            for start in range(0, view.count, self.block_size):
+                end = min(start + self.block_size, view.count)
+                yield np.arange(start, end), view.vectors[start:end]
+        else:
+            for start in range(0, len(rows), self.block_size):
+                block = rows[start:start + self.block_size]
+                yield block, view.vectors[block]
+
+    def search_vectors(
+        self,
+        queries: np.ndarray,
+        k: int,
+        rows: Optional[np.ndarray] = None,
+        rescore_factor: Optional[int] = None,
+        view: Optional[Snapshot] = None
+    ) -> List[List[Tuple[int, float]]]:
+        '''
+            Top-k cosine similarity of several queries at once, exact for float stores and rescored
+            with the float vectors for quantized stores that keep them
+
+            Parameters:
+                queries: np.ndarray - A (n_queries, dim) matrix
+                k: int - The number of results per query
+                rows: Optional[np.ndarray] - Restrict the search to these rows (pre-filtering), all rows by default
+                rescore_factor: Optional[int] - Override the number of candidates per result rescored
+                view: Optional[Snapshot] - The matrix to search, taken under the lock if not given, so
+                    concurrent writes never change it mid-search
+
+            Returns:
+                List[List[Tuple[int, float]]] - (row, similarity) pairs per query, best first
+        '''
+
+        view = view or self.snapshot()
+        if rows is not None:
+            # Rows filtered after a compaction may lie past the end of an older view
+            rows = rows[rows < view.count]
+        if view.vectors is None or not view.count or (rows is not None and not len(rows)):
+            return [[] for _ in queries]
+
+        queries = np.asarray(queries, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        packed_queries = np.packbits(queries > 0, axis=1) if self.dtype == 'binary' else None
+
+        rescore = view.full_vectors is not None
+        n_candidates = k * (rescore_factor or self.rescore_factor) if rescore else k
+
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for block_rows, block in self.iter_blocks(view, rows):
+            scores = self.score_block(queries, packed_queries, block)
+            scores[:, ~view.alive[block_rows]] = -np.inf
+
+            # Keep the best candidates of (current best, this block)
+            scores = np.concatenate([best_scores, scores], axis=1)
+            block_rows = np.concatenate([best_rows, np.broadcast_to(block_rows, (len(queries), len(block_rows)))], axis=1)
+            if scores.shape[1] > n_candidates:
+                top = np.argpartition(-scores, n_candidates - 1, axis=1)[:, :n_candidates]
+                scores = np.take_along_axis(scores, top, axis=1)
+                block_rows = np.take_along_axis(block_rows, top, axis=1)
+            best_scores, best_rows = scores, block_rows
+
+        results = []
+        for query, rows, scores in zip(queries, best_rows, best_scores):
+            rows = rows[np.isfinite(scores)]
+            scores = scores[np.isfinite(scores)]
+            if rescore and len(rows):
+                # Second stage: exact similarity of the candidates from the float vectors
+                order = np.argsort(rows)
+                rows = rows[order]
+                scores = view.full_vectors[rows] @ query
+
+            order = np.argsort(-scores)[:k]
+            results.append([(int(rows[i]), float(scores[i])) for i in order])
+
+        return results
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[dict] = None,
+        **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        while True:
+            view = self.snapshot()
+            rows = self.filter_rows(filter) if filter else None
+            hits = self.search_vectors(np.asarray([embedding]), k, rows=rows, rescore_factor=kwargs.get("rescore_factor"), view=view)[0]
+            if not hits:
+                return []
+
+            # A compaction during the search renumbered the rows, search the new matrix. Rows deleted
+            # during the search are dropped
+            found = self.get_documents([row for row, _ in hits], generation=view.generation)
+            if found is not None:
+                return [(found[row], score) for row, score in hits if row in found]
+
+    def similarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        '''
+            Returns (document, cosine similarity) pairs, higher is more similar. A metadata filter
+            (filter=...) restricts the scored rows before the search
+        '''
+
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        **kwargs: Any
+    ) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        **kwargs: Any
+    ) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # Cosine similarity in [-1, 1] to a relevance score in [0, 1], clipped against float rounding
+        return lambda score: min(max((score + 1) / 2, 0.0), 1.0)
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        persist_directory: str = "./numpy_db/default",
+        **kwargs: Any
+    ) -> "NumpyVectorStore":
+        store = cls(persist_directory=persist_directory, embedding=embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+
+        return store
+
+
+def benchmark(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    rescore_factors: List[int] = [1, 4, 10]
+) -> None:
+    '''
+        Print the recall@k (against exact float32 search), query latency and matrix size of every
+        storage type, with and without rescoring, to pick settings for a collection
+
+        Parameters:
+            vectors: np.ndarray - The (n, dim) vectors of the collection
+            queries: np.ndarray - The (n_queries, dim) query vectors
+            k: int - The number of results per query
+            rescore_factors: List[int] - The rescoring factors to try on quantized stores
+    '''
+
+    configs = [('float32', False, 1), ('float16', False, 1), ('int8', False, 1), ('binary', False, 1)]
+    configs += [(dtype, True, factor) for dtype in ('int8', 'binary') for factor in rescore_factors]
+
+    truth = None
+    texts = [str(i) for i in range(len(vectors))]
+    print(f"{len(vectors)} vectors of dim {vectors.shape[1]}, {len(queries)} queries, k={k}")
+    print(f"{'dtype':<8} {'rescore':>7} {'recall':>7} {'ms/query':>9} {'MB':>8}")
+    for dtype, rescore, factor in configs:
+        with tempfile.TemporaryDirectory() as directory:
+            store = NumpyVectorStore(directory, embedding=None, dtype=dtype, rescore=rescore, rescore_factor=factor)
+            store.add_embeddings(texts, vectors.tolist())
+
+            start = time.perf_counter()
+            results = store.search_vectors(queries, k)
+            latency = (time.perf_counter() - start) * 1000 / len(queries)
+
+            found = [{row for row, _ in hits} for hits in results]
+            if truth is None:
+                truth = found
+            recall = np.mean([len(a & b) / k for a, b in zip(found, truth)])
+            size = store.vectors[:store.count].nbytes / 2 ** 20
+
+            print(f"{dtype:<8} {(f'x{factor}' if rescore else '-'):>7} {recall:>7.3f} {latency:>9.2f} {size:>8.1f}")
+
+
+if __name__ == "__main__":
+    # python src/rag/numpy_store.py [n_vectors] [dim], clustered synthetic vectors shaped like sentence embeddings
+    n_vectors = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else 384
+
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((256, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), n_vectors)] + 0.6 * rng.standard_normal((n_vectors, dim)).astype(np.float32)
+    queries = vectors[rng.choice(n_vectors, 100, replace=False)] + 0.3 * rng.standard_normal((100, dim)).astype(np.float32)
+
+    benchmark(vectors, queries)
+
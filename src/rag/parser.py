@@ -1,7 +1,53 @@
 import re
+from typing import AsyncIterator, Iterator, Union
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration
 from langchain_core.output_parsers import StrOutputParser
 
 
+class AnswerPrefixStripper(object):
+    def __init__(self, prefix: str = "Answer:") -> None:
+        '''
+            Incrementally strips a leading answer prefix from streamed text. Text is held back only
+            while it could still be the start of the prefix, then passed through as it arrives
+
+            Parameters:
+                prefix: str - The prefix to strip
+        '''
+
+        self.prefix = prefix
+        self.buffer = ""
+        self.passthrough = False
+
+    def feed(self, text: str) -> str:
+        if self.passthrough:
+            return text
+
+        self.buffer += text
+        head = self.buffer.lstrip()
+        if not head:
+            return ""
+
+        if head.startswith(self.prefix):
+            rest = head[len(self.prefix):].lstrip()
+            if not rest:
+                # Wait for the answer itself so leading whitespace can be dropped
+                return ""
+            head = rest
+        elif self.prefix.startswith(head):
+            return ""
+
+        self.passthrough = True
+        self.buffer = ""
+        return head
+
+    def flush(self) -> str:
+        # The stream ended while undecided, e.g. an answer shorter than the prefix
+        text = "" if self.passthrough else self.buffer.strip()
+        self.passthrough, self.buffer = True, ""
+        return "" if text == self.prefix else text
+
+
 class OutputParser(StrOutputParser):
     def __init__(self) -> None:
         super().__init__()
@@ -26,4 +72,29 @@ class OutputParser(StrOutputParser):
         else:
             return text_response
 
-        
\ No newline at end of file
+    @staticmethod
+    def chunk_text(chunk: Union[str, BaseMessage]) -> str:
+        return ChatGeneration(message=chunk).text if isinstance(chunk, BaseMessage) else chunk
+
+    def _transform(self, input: Iterator[Union[str, BaseMessage]]) -> Iterator[str]:
+        stripper = AnswerPrefixStripper()
+        for chunk in input:
+            text = stripper.feed(self.chunk_text(chunk))
+            if text:
+                yield text
+
+        text = stripper.flush()
+        if text:
+            yield text
+
+    async def _atransform(self, input: AsyncIterator[Union[str, BaseMessage]]) -> AsyncIterator[str]:
+        stripper = AnswerPrefixStripper()
+        async for chunk in input:
+            text = stripper.feed(self.chunk_text(chunk))
+            if text:
+                yield text
+
+        text = stripper.flush()
+        if text:
+            yield text
+
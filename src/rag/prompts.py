@@ -0,0 +1,15 @@
+from langchain_core.prompts import ChatPromptTemplate
+
+
+# Local copy of the "rlm/rag-prompt" hub prompt, so building the chain needs no hub round-trip
+RAG_PROMPT = ChatPromptTemplate.from_messages([
+    (
+        "human",
+        "You are an assistant for question-answering tasks. Use the following pieces of retrieved context "
+        "to answer the question. If you don't know the answer, just say that you don't know. "
+        "Use three sentences maximum and keep the answer concise.\n"
+        "Question: {question} \n"
+        "Context: {context} \n"
+        "Answer:"
+    )
+])
@@ -0,0 +1,240 @@
+import os
+import json
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
+from langchain.retrievers import ContextualCompressionRetriever
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document, BaseDocumentCompressor
+from langchain_core.retrievers import BaseRetriever
+from loggers.logger import logger
+from rag.bm25 import fuse_rankings
+from rag.loader import DocumentLoader
+from rag.vector_store import VectorStore
+
+
+DEFAULT_COLLECTIONS = {
+    "Computer_Vision": {"data_dir": "data/", "storedb": "chroma"}
+}
+
+# Shared by every fan-out retriever, searches are I/O or BLAS bound and release the GIL
+executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="collection-search")
+
+
+class CollectionRegistry(object):
+    def __init__(
+        self,
+        collections: Optional[Dict[str, Dict[str, Any]]] = None
+    ) -> None:
+        '''
+            The topic collections of the deployment. Each entry maps a collection name to its
+            "data_dir", "storedb", an optional default metadata "filter" and extra VectorStore kwargs.
+            Collections are opened on first use
+
+            Parameters:
+                collections: Optional[Dict[str, Dict[str, Any]]] - The collection configs
+        '''
+
+        self.collections: Dict[str, Dict[str, Any]] = dict(collections or DEFAULT_COLLECTIONS)
+        self.stores: Dict[str, VectorStore] = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: Optional[str]) -> "CollectionRegistry":
+        '''
+            Load the collection configs from a JSON file, the default collection if there is none
+        '''
+
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return cls(json.load(f))
+
+        return cls()
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.collections)
+
+    @property
+    def version(self) -> str:
+        '''
+            Combined ingestion version of the opened collections
+        '''
+
+        digest = hashlib.sha256()
+        for name in sorted(self.stores):
+            digest.update(f"{name}:{self.stores[name].manifest.version}".encode("utf-8"))
+
+        return digest.hexdigest()
+
+    def register(
+        self,
+        name: str,
+        data_dir: str,
+        storedb: str = 'chroma',
+        filter: Optional[dict] = None,
+        **kwargs: Any
+    ) -> None:
+        self.collections[name] = {"data_dir": data_dir, "storedb": storedb, "filter": filter, **kwargs}
+
+    def get(self, name: str) -> VectorStore:
+        if name not in self.collections:
+            raise KeyError(f"Unknown collection: {name}")
+
+        if name not in self.stores:
+            with self.lock:
+                if name not in self.stores:
+                    config = {key: value for key, value in self.collections[name].items() if key not in ("data_dir", "filter")}
+                    self.stores[name] = VectorStore(name=name, **config)
+
+        return self.stores[name]
+
+    def ingest(self, names: Optional[List[str]] = None, loader: Optional[DocumentLoader] = None) -> None:
+        '''
+            Incrementally ingest the data directory of each collection
+        '''
+
+        loader = loader or DocumentLoader()
+        for name in names or self.names:
+            data_dir = self.collections[name].get("data_dir")
+            if data_dir:
+                self.get(name).ingest_directory(data_dir, loader)
+
+    def get_retriever(
+        self,
+        names: Optional[List[str]] = None,
+        k: int = 10,
+        filters: Optional[Dict[str, dict]] = None
+    ) -> "FanOutRetriever":
+        '''
+            Parameters:
+                names: Optional[List[str]] - The collections to search, all by default
+                k: int - The number of merged documents returned
+                filters: Optional[Dict[str, dict]] - Metadata filters per collection, override the configured ones
+        '''
+
+        names = names or self.names
+        configured = {name: self.collections[name].get("filter") for name in names if self.collections[name].get("filter")}
+
+        return FanOutRetriever(
+            stores={name: self.get(name) for name in names},
+            k=k,
+            filters={**configured, **(filters or {})}
+        )
+
+    def get_compression_retriever(
+        self,
+        names: Optional[List[str]] = None,
+        k: int = 10,
+        filters: Optional[Dict[str, dict]] = None,
+        reranker: Optional[Union[str, BaseDocumentCompressor]] = None
+    ) -> ContextualCompressionRetriever:
+        '''
+            Reranked retriever over the collections. A single unfiltered collection uses its hybrid
+            retriever, otherwise a FanOutRetriever fuses the dense and BM25 rankings of every collection
+        '''
+
+        names = names or self.names
+        if len(names) == 1 and not filters and not self.collections[names[0]].get("filter"):
+            return self.get(names[0]).get_compression_retriever(search_type='hybrid', search_kwargs={'k': k}, reranker=reranker)
+
+        return ContextualCompressionRetriever(
+            base_compressor=self.get(names[0]).get_reranker(reranker),
+            base_retriever=self.get_retriever(names, k=k, filters=filters)
+        )
+
+
+class FanOutRetriever(BaseRetriever):
+    '''
+        Searches several collections concurrently, each with its dense ranking and, when it has a BM25
+        index, its sparse ranking, and fuses every ranking with reciprocal rank fusion. Relevance scores
+        are not comparable across backends (Chroma maps L2 distances, the NumPy store cosines), ranks are
+    '''
+
+    stores: Dict[str, Any]
+    k: int = 10
+    fetch_k: int = 20
+    dense_weight: float = 0.5
+    filters: Dict[str, dict] = {}
+
+    def search_kwargs(self, name: str) -> Dict[str, Any]:
+        return {"k": self.fetch_k, **self.stores[name].filter_kwargs(self.filters.get(name))}
+
+    def merge(self, results: List[Tuple[str, List[Tuple[List[Tuple[Document, float]], float]]]]) -> List[Document]:
+        rankings, weights = [], []
+        for name, weighted_rankings in results:
+            for ranking, weight in weighted_rankings:
+                rankings.append([
+                    (Document(page_content=document.page_content, metadata={**document.metadata, "collection": name}), score)
+                        for document, score in ranking
+                ])
+                weights.append(weight)
+
+        return [document for document, _ in fuse_rankings(rankings, self.k, fusion='rrf', weights=weights)]
+
+    def weighted(
+        self,
+        dense: List[Tuple[Document, float]],
+        sparse: Optional[List[Tuple[Document, float]]]
+    ) -> List[Tuple[List[Tuple[Document, float]], float]]:
+        if sparse is None:
+            return [(dense, 1.0)]
+
+        return [(dense, self.dense_weight), (sparse, 1 - self.dense_weight)]
+
+    def sparse_search(self, name: str, query: str) -> Optional[List[Tuple[Document, float]]]:
+        sparse_index = self.stores[name].sparse_index
+        if sparse_index is None:
+            return None
+
+        try:
+            return sparse_index.search(query, k=self.fetch_k, filter=self.filters.get(name))
+        except Exception as e:
+            logger.error(f"Error searching the BM25 index of collection {name}: {e}")
+            return []
+
+    def search(self, name: str, query: str) -> List[Tuple[List[Tuple[Document, float]], float]]:
+        try:
+            dense = self.stores[name].vectorstore.similarity_search_with_relevance_scores(query, **self.search_kwargs(name))
+        except Exception as e:
+            # One failing collection should not fail the query
+            logger.error(f"Error searching collection {name}: {e}")
+            dense = []
+
+        return self.weighted(dense, self.sparse_search(name, query))
+
+    async def asearch(self, name: str, query: str) -> List[Tuple[List[Tuple[Document, float]], float]]:
+        async def dense_search() -> List[Tuple[Document, float]]:
+            try:
+                return await self.stores[name].vectorstore.asimilarity_search_with_relevance_scores(query, **self.search_kwargs(name))
+            except Exception as e:
+                logger.error(f"Error searching collection {name}: {e}")
+                return []
+
+        dense, sparse = await asyncio.gather(dense_search(), asyncio.to_thread(self.sparse_search, name, query))
+
+        return self.weighted(dense, sparse)
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        names = list(self.stores)
+        results = executor.map(lambda name: self.search(name, query), names)
+
+        return self.merge(list(zip(names, results)))
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        names = list(self.stores)
+        results = await asyncio.gather(*(self.asearch(name, query) for name in names))
+
+        return self.merge(list(zip(names, results)))
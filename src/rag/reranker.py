@@ -0,0 +1,158 @@
+import hashlib
+from abc import abstractmethod
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Literal, Optional, Sequence, Tuple
+from pydantic import PrivateAttr
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import Document, BaseDocumentCompressor
+from config import envConfig
+
+
+def document_key(document: Document) -> str:
+    '''
+        Stable id of a document for the score cache: its store id, or the hash of its content
+    '''
+
+    doc_id = getattr(document, "id", None) or document.metadata.get("id")
+    return doc_id or hashlib.sha1(document.page_content.encode("utf-8")).hexdigest()
+
+
+class Reranker(BaseDocumentCompressor):
+    '''
+        Reranks at most candidate_budget retrieved documents and keeps the top_n. Scores are cached
+        per (query, document id), so repeated queries only score documents they have not seen
+    '''
+
+    top_n: int = 3
+    candidate_budget: int = 10
+    cache_size: int = 10_000
+
+    _cache: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @abstractmethod
+    def score(self, query: str, documents: List[Document]) -> List[float]:
+        '''
+            Relevance score of each document for the query, higher is more relevant
+        '''
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None
+    ) -> Sequence[Document]:
+        candidates = list(documents)[:self.candidate_budget]
+        if not candidates:
+            return []
+
+        keys = [(query, document_key(document)) for document in candidates]
+        with self._lock:
+            scores: Dict[Tuple[str, str], float] = {key: self._cache[key] for key in keys if key in self._cache}
+
+        missing = {key: document for key, document in zip(keys, candidates) if key not in scores}
+        if missing:
+            new_scores = self.score(query, list(missing.values()))
+            scores.update(zip(missing.keys(), new_scores))
+
+            with self._lock:
+                for key, score in zip(missing.keys(), new_scores):
+                    self._cache[key] = score
+                    self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        ranked = sorted(zip(candidates, keys), key=lambda item: scores[item[1]], reverse=True)[:self.top_n]
+
+        return [
+            Document(
+                id=getattr(document, "id", None),
+                page_content=document.page_content,
+                metadata={**document.metadata, "relevance_score": float(scores[key])}
+            )
+                for document, key in ranked
+        ]
+
+
+@lru_cache(maxsize=None)
+def load_cross_encoder(model_name: str, backend: str, file_name: Optional[str]) -> Any:
+    '''
+        Load a cross-encoder once per process, shared by every retriever
+    '''
+
+    from sentence_transformers import CrossEncoder
+
+    model_kwargs = {"file_name": file_name} if file_name else None
+    return CrossEncoder(model_name, device="cpu", backend=backend, model_kwargs=model_kwargs)
+
+
+class CrossEncoderReranker(Reranker):
+    '''
+        Local CPU cross-encoder, opt-in with RERANKER=cross_encoder. The default model is English-only,
+        set model_name to a multilingual cross-encoder for other corpora. backend="onnx" with a quantized file_name
+        (e.g. "onnx/model_qint8_avx512_vnni.onnx") trades a little accuracy for speed
+    '''
+
+    model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    backend: Literal['torch', 'onnx'] = 'torch'
+    file_name: Optional[str] = None
+    batch_size: int = 32
+
+    def score(self, query: str, documents: List[Document]) -> List[float]:
+        model = load_cross_encoder(self.model_name, self.backend, self.file_name)
+        scores = model.predict(
+            [(query, document.page_content) for document in documents],
+            batch_size=self.batch_size,
+            show_progress_bar=False
+        )
+
+        return [float(score) for score in scores]
+
+
+@lru_cache(maxsize=None)
+def load_cohere_rerank(model_name: str) -> Any:
+    from langchain_cohere import CohereRerank
+
+    return CohereRerank(model=model_name, cohere_api_key=envConfig.COHERE_API_KEY)
+
+
+class CohereReranker(Reranker):
+    '''
+        Remote Cohere rerank, one request per query for the documents missing from the cache
+    '''
+
+    model_name: str = "rerank-multilingual-v3.0"
+
+    def score(self, query: str, documents: List[Document]) -> List[float]:
+        results = load_cohere_rerank(self.model_name).rerank(documents, query, top_n=len(documents))
+
+        scores = [float("-inf")] * len(documents)
+        for result in results:
+            scores[result["index"]] = result["relevance_score"]
+
+        return scores
+
+
+@lru_cache(maxsize=None)
+def get_reranker(
+    kind: Literal['cross_encoder', 'cohere'] = 'cohere',
+    top_n: int = 3,
+    candidate_budget: int = 10
+) -> Reranker:
+    '''
+        Shared reranker instance per configuration, so retrievers share the model and the score cache
+    '''
+
+    if kind == 'cross_encoder':
+        return CrossEncoderReranker(
+            top_n=top_n,
+            candidate_budget=candidate_budget,
+            backend=envConfig.RERANKER_BACKEND,
+            file_name=envConfig.RERANKER_FILE_NAME
+        )
+    if kind == 'cohere':
+        return CohereReranker(top_n=top_n, candidate_budget=candidate_budget)
+
+    raise ValueError(f"Invalid reranker: {kind}")
@@ -0,0 +1,231 @@
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import run_in_executor
+from loggers.logger import logger
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", query)).strip().lower()
+
+
+class SemanticCache(object):
+    def __init__(
+        self,
+        embedding: Embeddings,
+        threshold: float = 0.95,
+        ttl_seconds: Optional[float] = 3600,
+        max_entries: int = 1000,
+        version: Optional[Callable[[], str]] = None,
+        name: str = "semantic"
+    ) -> None:
+        '''
+            Query -> result cache. A query hits when its normalized text was seen before, or when its
+            embedding is within threshold cosine similarity of a cached query. Entries expire after
+            ttl_seconds, the least recently used are evicted past max_entries, and everything is
+            dropped when version() changes (e.g. the ingestion version of the collection)
+
+            Parameters:
+                embedding: Embeddings - The model embedding the queries
+                threshold: float - The minimum cosine similarity of a semantic hit
+                ttl_seconds: Optional[float] - The lifetime of an entry, None to keep entries until evicted
+                max_entries: int - The maximum number of entries
+                version: Optional[Callable[[], str]] - Returns the version the cached results depend on
+                name: str - The name of the cache in the logs
+        '''
+
+        self.embedding = embedding
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.version = version
+        self.name = name
+        self.lock = threading.Lock()
+
+        self.current_version = version() if version else None
+        self.entries: "OrderedDict[str, Tuple[Any, np.ndarray, float]]" = OrderedDict()
+
+        # Stacked query vectors, rebuilt lazily after the entries change
+        self.keys: List[str] = []
+        self.matrix: Optional[np.ndarray] = None
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.matrix = None
+
+    def check_version(self) -> None:
+        if self.version is None:
+            return
+
+        version = self.version()
+        if version != self.current_version:
+            if self.entries:
+                logger.info(f"{self.name} cache invalidated, collection version changed")
+                self.invalidations += 1
+            self.entries.clear()
+            self.matrix = None
+            self.current_version = version
+
+    def expired(self, created_at: float) -> bool:
+        return self.ttl_seconds is not None and time.monotonic() - created_at > self.ttl_seconds
+
+    def embed(self, query: str) -> np.ndarray:
+        vector = np.asarray(self.embedding.embed_query(query), dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def get(self, query: str) -> Optional[Any]:
+        '''
+            Return the cached result of query or of a semantically equivalent query, None on a miss
+        '''
+
+        key = normalize_query(query)
+        with self.lock:
+            self.check_version()
+
+            entry = self.entries.get(key)
+            if entry is not None and not self.expired(entry[2]):
+                self.entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry[0]
+
+            if not self.entries:
+                self.misses += 1
+                return None
+
+        vector = self.embed(query)
+
+        with self.lock:
+            if self.matrix is None:
+                self.keys = list(self.entries)
+                self.matrix = np.stack([self.entries[k][1] for k in self.keys]) if self.keys else None
+
+            if self.matrix is not None:
+                similarities = self.matrix @ vector
+                for i in np.argsort(-similarities):
+                    if similarities[i] < self.threshold:
+                        break
+
+                    entry = self.entries.get(self.keys[i])
+                    if entry is None or self.expired(entry[2]):
+                        continue
+
+                    self.entries.move_to_end(self.keys[i])
+                    self.semantic_hits += 1
+                    logger.info(f"{self.name} cache hit for '{query}' (similarity {similarities[i]:.3f})")
+                    return entry[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, query: str, value: Any) -> None:
+        key = normalize_query(query)
+        vector = self.embed(query)
+
+        with self.lock:
+            self.check_version()
+
+            self.entries[key] = (value, vector, time.monotonic())
+            self.entries.move_to_end(key)
+
+            now = time.monotonic()
+            for stale in [k for k, (_, _, created_at) in self.entries.items() if self.ttl_seconds is not None and now - created_at > self.ttl_seconds]:
+                del self.entries[stale]
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+            self.matrix = None
+
+
+class CachedRunnable(Runnable):
+    def __init__(
+        self,
+        runnable: Runnable,
+        cache: SemanticCache
+    ) -> None:
+        '''
+            Short-circuits a runnable taking a question string with a semantic cache
+
+            Parameters:
+                runnable: Runnable - The runnable to cache, e.g. a retriever or a whole chain
+                cache: SemanticCache - The cache
+        '''
+
+        self.runnable = runnable
+        self.cache = cache
+
+    def invoke(self, input: str, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        cached = self.cache.get(input)
+        if cached is not None:
+            return cached
+
+        output = self.runnable.invoke(input, config, **kwargs)
+        self.cache.put(input, output)
+
+        return output
+
+    async def ainvoke(self, input: str, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        # Lookups embed the query, keep them off the event loop
+        cached = await run_in_executor(config, self.cache.get, input)
+        if cached is not None:
+            return cached
+
+        output = await self.runnable.ainvoke(input, config, **kwargs)
+        await run_in_executor(config, self.cache.put, input, output)
+
+        return output
+
+    def stream(self, input: str, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[Any]:
+        cached = self.cache.get(input)
+        if cached is not None:
+            yield cached
+            return
+
+        output = None
+        for chunk in self.runnable.stream(input, config, **kwargs):
+            output = chunk if output is None else output + chunk
+            yield chunk
+
+        if output is not None:
+            self.cache.put(input, output)
+
+    async def astream(self, input: str, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        cached = await run_in_executor(config, self.cache.get, input)
+        if cached is not None:
+            yield cached
+            return
+
+        output = None
+        async for chunk in self.runnable.astream(input, config, **kwargs):
+            output = chunk if output is None else output + chunk
+            yield chunk
+
+        if output is not None:
+            await run_in_executor(config, self.cache.put, input, output)
+
@@ -1,66 +1,123 @@
+import os
+import time
 import torch
-from typing import Literal
+from itertools import islice
+from typing import Literal, Optional, List, Iterable, Set, Union
 from uuid import uuid4
 from pinecone import Pinecone
-from langchain.vectorstores import FAISS
-from langchain.docstore import InMemoryDocstore
 from langchain.schema import Document
 from langchain.retrievers import ContextualCompressionRetriever
 from langchain.retrievers.multi_vector import MultiVectorRetriever
-from langchain.storage import InMemoryByteStore
-from langchain_core.stores import InMemoryStore
 from langchain_chroma import Chroma
 from langchain_pinecone import PineconeVectorStore
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain_cohere import CohereRerank
+from langchain_core.documents import BaseDocumentCompressor
 from pinecone import ServerlessSpec
 
 from config import envConfig
+from llms.embedding_models import embedding_service
+from loggers.logger import logger
+from rag.loader import DocumentLoader
+from rag.manifest import IngestionManifest, SCHEMA_VERSION
+from rag.numpy_store import NumpyVectorStore
+from rag.faiss_store import TunableFAISS
+from rag.reranker import get_reranker
+from rag.bm25 import BM25Index, HybridRetriever
+from rag.docstore import SQLiteDocStore
+from rag.filters import matches, to_chroma_filter
 
 
 class VectorStore:
     def __init__(
         self,
         name: str,
-        documents: list[Document],
-        storedb: Literal['chroma', 'faiss', 'pinecone'] = 'chroma',
+        documents: Optional[list[Document]] = None,
+        storedb: Literal['chroma', 'faiss', 'pinecone', 'numpy'] = 'chroma',
+        mode: Literal['open_or_build', 'rebuild'] = 'open_or_build',
         **kwargs
     ) -> None:
         '''
             Parameters:
                 name: str - The name of the vector store
-                documents: list[Document] - The documents to add to the vector store
-                storedb: Literal['chroma', 'faiss', 'pinecone'] - The type of vector store to use
+                documents: Optional[list[Document]] - The documents to add to the vector store. Leave empty
+                    and call `ingest_directory` to ingest a corpus incrementally
+                storedb: Literal['chroma', 'faiss', 'pinecone', 'numpy'] - The type of vector store to use
+                mode: Literal['open_or_build', 'rebuild'] - Attach to the persisted collection when it matches the
+                    ingestion manifest and embedding model, or always start from an empty collection
                 **kwargs - Additional keyword arguments to pass to the vector store
         '''
 
         self.name = name
-        self.documents = documents
+        self.storedb = storedb
+        self.mode = mode
+        self.documents = documents or []
+        self.persist_directory = kwargs.get("persist_directory", f"./{storedb}_db/{name}")
+        self.batch_size = kwargs.get("batch_size", 256)
+
+        # Ingestion manifest, records which files (and chunks) are already embedded
+        self.manifest = IngestionManifest(os.path.join(self.persist_directory, "manifest.json"))
+
+        # BM25 index maintained alongside the vectors, for hybrid retrieval
+        self.sparse_index = BM25Index(os.path.join(self.persist_directory, "bm25.sqlite3")) if kwargs.get("sparse_index", True) else None
 
-        # Embedding model
-        self.embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+        # Parent (page) documents of the chunks, returned by the multi-vector retriever
+        self.docstore = SQLiteDocStore(os.path.join(self.persist_directory, "parents.sqlite3")) if kwargs.get("parent_docstore", True) else None
+
+        # Embedding model, shared with the long-term memory
+        self.embedding_model = embedding_service
 
         # Indices for documents
-        self.ids = [str(uuid4()) for _ in range(len(documents))]
+        self.ids = [str(uuid4()) for _ in range(len(self.documents))]
+
+        # Documents passed directly are their own parents
+        if self.docstore is not None and self.documents:
+            self.documents = [
+                Document(page_content=document.page_content, metadata={**document.metadata, "doc_id": doc_id})
+                    for doc_id, document in zip(self.ids, self.documents)
+            ]
 
         if storedb == 'chroma':
-            # Chroma vector store
-            self.vectorstore = Chroma.from_documents(
-                documents=documents,
-                ids=self.ids,
+            # Chroma vector store, attaches to the persisted collection if there is one
+            self.vectorstore = Chroma(
                 collection_name=name,
+                embedding_function=self.embedding_model,
+                persist_directory=self.persist_directory
+            )
+            self.validate_collection(self.vectorstore._collection.count())
+
+            if self.documents:
+                self.add_documents_in_batches(self.documents, ids=self.ids)
+        elif storedb == 'numpy':
+            # Local store on a memory-mapped matrix, dtype is one of float32, float16, int8 or binary;
+            # quantized types rescore their candidates with float vectors unless rescore=False
+            self.vectorstore = NumpyVectorStore(
+                persist_directory=self.persist_directory,
                 embedding=self.embedding_model,
-                persist_directory=f"./chroma_db/{name}"
+                dtype=kwargs.get("dtype", "float32"),
+                rescore=kwargs.get("rescore"),
+                rescore_factor=kwargs.get("rescore_factor", 4)
             )
+            self.validate_collection(len(self.vectorstore))
+
+            if self.documents:
+                self.add_documents_in_batches(self.documents, ids=self.ids)
         elif storedb == 'faiss':
-            # FAISS vector store
-            self.vectorstore = FAISS.from_documents(
-                documents=documents,
-                embedding=self.embedding_model,
-                index=self.name,
-                docstore=InMemoryDocstore({}),
-                index_to_docstore_id={},
+            # FAISS vector store, index_type is one of flat, ivf_pq or hnsw; index_kwargs={"refine": True}
+            # rescores the approximate candidates with the float vectors
+            self.vectorstore = TunableFAISS.open_or_create(
+                self.persist_directory,
+                self.embedding_model,
+                index_type=kwargs.get("index_type", "flat"),
+                index_kwargs=kwargs.get("index_kwargs"),
+                nprobe=kwargs.get("nprobe", 16),
+                ef_search=kwargs.get("ef_search", 64),
+                train_size=kwargs.get("train_size", 50_000),
+                refine_k_factor=kwargs.get("refine_k_factor", 4)
             )
+            self.validate_collection(len(self.vectorstore))
+
+            if self.documents:
+                self.add_documents_in_batches(self.documents, ids=self.ids)
+                self.persist()
         elif storedb == 'pinecone':
             # Pinecone vector store
             pc = Pinecone()
@@ -77,27 +134,270 @@ class VectorStore:
                 index=index,
                 embedding=self.embedding_model,
             )
-            self.vectorstore.add_documents(documents, ids=self.ids)
+            if self.documents:
+                self.add_documents_in_batches(self.documents, ids=self.ids)
         else:       
             raise ValueError(f"Invalid vector store: {storedb}")
 
+        if self.docstore is not None and self.documents:
+            self.docstore.mset(list(zip(self.ids, self.documents)))
+
+    def validate_collection(self, stored_count: int) -> None:
+        '''
+            Check the persisted collection against the ingestion manifest and the embedding model.
+            A changed embedding model or chunk schema, or a legacy collection without manifest, resets
+            the collection and the manifest so the next ingestion rebuilds it. Counts that disagree
+            with the manifest (an interrupted ingestion) only repair the files concerned, see
+            repair_collection; otherwise only the delta gets ingested
+
+            Parameters:
+                stored_count: int - The number of vectors in the persisted collection
+        '''
+
+        expected_count = self.manifest.chunk_count()
+        model_name = self.embedding_model.model_name
+
+        if self.mode == 'rebuild':
+            reason = "rebuild requested"
+        elif self.manifest.schema_version not in (None, SCHEMA_VERSION):
+            reason = f"chunk schema changed from {self.manifest.schema_version} to {SCHEMA_VERSION}"
+        elif self.manifest.embedding_model not in (None, model_name):
+            reason = f"embedding model changed from {self.manifest.embedding_model} to {model_name}"
+        elif stored_count and not self.manifest.files:
+            reason = "collection has no ingestion manifest"
+        else:
+            reason = None
+
+        if reason and (stored_count or self.manifest.files):
+            logger.info(f"Rebuilding collection {self.name}: {reason}")
+            self.vectorstore.reset_collection()
+            self.manifest.reset()
+            if self.sparse_index is not None:
+                self.sparse_index.reset()
+            if self.docstore is not None:
+                self.docstore.reset()
+        elif (
+            stored_count != expected_count
+            or (self.sparse_index is not None and len(self.sparse_index) != expected_count)
+            or (self.docstore is not None and len(self.docstore) != self.manifest.parent_count())
+        ):
+            self.repair_collection()
+        elif stored_count:
+            logger.info(f"Attached to persisted collection {self.name} ({stored_count} vectors)")
+
+        self.manifest.embedding_model = model_name
+        self.manifest.schema_version = SCHEMA_VERSION
+        self.manifest.save()
+
+    def stored_ids(self) -> Set[str]:
+        '''
+            The ids of every vector in the collection
+        '''
+
+        if isinstance(self.vectorstore, NumpyVectorStore):
+            return set(self.vectorstore.ids)
+        if isinstance(self.vectorstore, TunableFAISS):
+            return set(self.vectorstore.index_to_docstore_id.values()).union(item[3] for item in self.vectorstore.pending)
+
+        return set(self.vectorstore._collection.get(include=[])["ids"])
+
+    def repair_collection(self) -> None:
+        '''
+            Bring the stores back in line with the manifest after an interrupted ingestion, without
+            re-embedding the corpus: files whose chunks or parents are partly missing are dropped from
+            every store and from the manifest, so the next ingestion re-ingests only them, and entries
+            that no file of the manifest owns are deleted
+        '''
+
+        chunk_owners = {chunk_id: file_path for file_path in self.manifest.files for chunk_id in self.manifest.get_chunk_ids(file_path)}
+        parent_owners = {parent_id: file_path for file_path in self.manifest.files for parent_id in self.manifest.get_parent_ids(file_path)}
+
+        vector_ids = self.stored_ids()
+        sparse_ids = self.sparse_index.ids() if self.sparse_index is not None else set(chunk_owners)
+        parent_ids = set(self.docstore.yield_keys()) if self.docstore is not None else set(parent_owners)
+
+        incomplete = {file_path for chunk_id, file_path in chunk_owners.items() if chunk_id not in vector_ids or chunk_id not in sparse_ids}
+        incomplete.update(file_path for parent_id, file_path in parent_owners.items() if parent_id not in parent_ids)
+
+        for file_path in incomplete:
+            self.manifest.remove(file_path)
+
+        # Delete only what is actually stored, an interrupted file never wrote some of its ids
+        kept_chunks = {chunk_id for chunk_id, file_path in chunk_owners.items() if file_path not in incomplete}
+        kept_parents = {parent_id for parent_id, file_path in parent_owners.items() if file_path not in incomplete}
+        if vector_ids - kept_chunks:
+            self.vectorstore.delete(ids=list(vector_ids - kept_chunks))
+        if self.sparse_index is not None:
+            self.sparse_index.delete(list(sparse_ids - kept_chunks))
+        if self.docstore is not None:
+            self.docstore.mdelete(list(parent_ids - kept_parents))
+
+        self.persist()
+        logger.info(f"Repaired collection {self.name}: {len(incomplete)} incomplete files will be re-ingested")
+
     def add_documents(
         self,
         documents: list[Document],
     ):
-        uuids = [str(uuid4()) for _ in range(len(documents))]
-        self.vectorstore.add_documents(documents, ids=uuids)
+        self.add_documents_in_batches(documents)
+        self.persist()
+
+    def add_documents_in_batches(
+        self,
+        documents: Iterable[Document],
+        ids: Optional[Iterable[str]] = None,
+        batch_size: Optional[int] = None
+    ) -> int:
+        '''
+            Consumes a (possibly lazy) iterable of documents and embeds it in bounded batches,
+            so memory stays proportional to the batch size instead of the corpus size
+
+            Parameters:
+                documents: Iterable[Document] - The documents to add, e.g. DocumentLoader.iter_chunks
+                ids: Optional[Iterable[str]] - The ids of the documents, random ids are used if not given
+                batch_size: Optional[int] - The number of documents embedded per batch
+
+            Returns:
+                int - The number of documents added
+        '''
+
+        batch_size = batch_size or self.batch_size
+        documents = iter(documents)
+        ids = iter(ids) if ids is not None else None
+
+        total = 0
+        while batch := list(islice(documents, batch_size)):
+            batch_ids = list(islice(ids, len(batch))) if ids is not None else [str(uuid4()) for _ in batch]
+            self.vectorstore.add_documents(batch, ids=batch_ids)
+            if self.sparse_index is not None:
+                self.sparse_index.add(batch_ids, batch)
+            total += len(batch)
+
+        return total
+
+    def persist(self) -> None:
+        '''
+            Save stores that only live in memory between writes (FAISS), other backends persist on write
+        '''
+
+        if isinstance(self.vectorstore, TunableFAISS):
+            self.vectorstore.persist(self.persist_directory)
+        if self.sparse_index is not None:
+            self.sparse_index.save()
+
+    def delete(
+        self,
+        ids: List[str]
+    ) -> None:
+        if ids:
+            self.vectorstore.delete(ids=ids)
+            if self.sparse_index is not None:
+                self.sparse_index.delete(ids)
+
+    def ingest_directory(
+        self,
+        dir_path: str,
+        loader: Optional[DocumentLoader] = None
+    ) -> None:
+        '''
+            Incrementally ingests a directory: only new or changed files are parsed, only chunks
+            whose content hash is not already stored are embedded, and chunks of removed files are deleted
+
+            Parameters:
+                dir_path: str - The path to the directory containing the files
+                loader: Optional[DocumentLoader] - The loader used to parse and split changed files
+        '''
+
+        loader = loader or DocumentLoader()
+        changed, removed = self.manifest.diff(loader.list_files(dir_path))
+        logger.info(f"Ingestion of {self.name}: {len(changed)} new or changed files, {len(removed)} removed files")
+
+        for file_path in removed:
+            if self.docstore is not None:
+                self.docstore.mdelete(self.manifest.get_parent_ids(file_path))
+            self.delete(self.manifest.remove(file_path))
+        self.manifest.save()
+
+        for file_path, pages, page_chunks in loader.load_file_pages(list(changed)):
+            file_hash = changed[file_path]
+            chunks = [chunk for chunks in page_chunks for chunk in chunks]
+            chunk_hashes = [IngestionManifest.hash_text(chunk.page_content) for chunk in chunks]
+
+            # Metadata kept end to end for filtering and citations: source, page, start_index (from the
+            # loader), content hash and ingestion time
+            ingested_at = int(time.time())
+            for chunk, chunk_hash in zip(chunks, chunk_hashes):
+                chunk.metadata["content_hash"] = chunk_hash
+                chunk.metadata["ingested_at"] = ingested_at
+
+            # The page is part of the chunk identity, so a chunk that moves to another page is
+            # re-added with its new metadata
+            parent_ids = IngestionManifest.parent_ids(file_path, len(pages)) if self.docstore is not None else []
+            chunk_pages = [page for page, chunks in enumerate(page_chunks) for _ in chunks]
+            chunk_ids = IngestionManifest.chunk_ids(
+                file_path,
+                [f"{page}:{chunk_hash}" for page, chunk_hash in zip(chunk_pages, chunk_hashes)]
+            )
+
+            if self.docstore is not None:
+                # Each chunk points to its page through doc_id
+                for chunk, page in zip(chunks, chunk_pages):
+                    chunk.metadata["doc_id"] = parent_ids[page]
+
+                self.docstore.mdelete(list(set(self.manifest.get_parent_ids(file_path)).difference(parent_ids)))
+                self.docstore.mset([
+                    (parent_id, Document(page_content=page.page_content, metadata={**page.metadata, "ingested_at": ingested_at}))
+                        for parent_id, page in zip(parent_ids, pages)
+                ])
+
+            old_ids = set(self.manifest.get_chunk_ids(file_path))
+            new_chunks = [(chunk_id, chunk) for chunk_id, chunk in zip(chunk_ids, chunks) if chunk_id not in old_ids]
+
+            self.delete(list(old_ids.difference(chunk_ids)))
+            self.add_documents_in_batches(
+                (chunk for _, chunk in new_chunks),
+                ids=(chunk_id for chunk_id, _ in new_chunks)
+            )
+
+            # Persist after every file so an interrupted ingestion resumes where it stopped
+            self.manifest.update(file_path, file_hash, chunk_hashes, chunk_ids, parent_ids)
+            self.manifest.save()
+
+            logger.info(f"Ingested {file_path}: {len(new_chunks)} chunks embedded, {len(chunks) - len(new_chunks)} reused")
+
+        self.persist()
+
+    def filter_kwargs(self, filter: Optional[dict]) -> dict:
+        '''
+            Translate a metadata filter (see rag.filters) into the search kwargs of the backend
+
+            Parameters:
+                filter: Optional[dict] - The metadata filter, e.g. {"source": "data/a.pdf", "ingested_at": {"$gte": 1700000000}}
+        '''
+
+        if not filter:
+            return {}
+        if self.storedb == 'chroma':
+            return {"filter": to_chroma_filter(filter)}
+        if self.storedb == 'faiss':
+            # FAISS post-filters, fetch more candidates so k results survive the filter
+            return {"filter": lambda metadata: matches(metadata, filter), "fetch_k": 200}
+
+        # The NumPy store pre-filters through its metadata index, Pinecone filters natively
+        return {"filter": filter}
 
     def search(
         self,
         query: str,
         search_kwargs: dict = {
             'k': 10,
-        }
+        },
+        filter: Optional[dict] = None
     ):
         return self.vectorstore.similarity_search(
             query=query,
-            **search_kwargs
+            **search_kwargs,
+            **self.filter_kwargs(filter)
         )
 
     def similarity_search_with_score(
@@ -105,61 +405,152 @@ class VectorStore:
         query: str,
         search_kwargs: dict = {
             'k': 10,
-        }
+        },
+        filter: Optional[dict] = None
     ):
         return self.vectorstore.similarity_search_with_score(
             query=query,
-            **search_kwargs
+            **search_kwargs,
+            **self.filter_kwargs(filter)
+        )
+
+    async def asearch(
+        self,
+        query: str,
+        search_kwargs: dict = {
+            'k': 10,
+        },
+        filter: Optional[dict] = None
+    ):
+        return await self.vectorstore.asimilarity_search(
+            query=query,
+            **search_kwargs,
+            **self.filter_kwargs(filter)
+        )
+
+    async def asimilarity_search_with_score(
+        self,
+        query: str,
+        search_kwargs: dict = {
+            'k': 10,
+        },
+        filter: Optional[dict] = None
+    ):
+        return await self.vectorstore.asimilarity_search_with_score(
+            query=query,
+            **search_kwargs,
+            **self.filter_kwargs(filter)
+        )
+
+    def get_reranker(self, reranker: Optional[Union[str, BaseDocumentCompressor]] = None) -> BaseDocumentCompressor:
+        if isinstance(reranker, BaseDocumentCompressor):
+            return reranker
+
+        return get_reranker(
+            reranker or envConfig.RERANKER,
+            top_n=envConfig.RERANK_TOP_N,
+            candidate_budget=envConfig.RERANK_CANDIDATES
+        )
+
+    def get_hybrid_retriever(
+        self,
+        k: int = 10,
+        fetch_k: int = 20,
+        fusion: Literal['rrf', 'weighted'] = 'rrf',
+        dense_weight: float = 0.5,
+        filter: Optional[dict] = None
+    ) -> HybridRetriever:
+        '''
+            Retriever fusing the dense ranking with the BM25 ranking
+
+            Parameters:
+                k: int - The number of fused documents returned
+                fetch_k: int - The number of documents fetched from each ranking
+                fusion: Literal['rrf', 'weighted'] - Reciprocal rank fusion or weighted normalized scores
+                dense_weight: float - The weight of the dense ranking, BM25 gets the rest
+                filter: Optional[dict] - The metadata filter applied to both rankings
+        '''
+
+        if self.sparse_index is None:
+            raise ValueError(f"Vector store {self.name} was created without a sparse index")
+
+        return HybridRetriever(
+            vectorstore=self.vectorstore,
+            sparse_index=self.sparse_index,
+            k=k,
+            fetch_k=fetch_k,
+            fusion=fusion,
+            dense_weight=dense_weight,
+            filter=filter,
+            dense_kwargs=self.filter_kwargs(filter)
         )
 
     def get_compression_retriever(
         self,
-        search_type: Literal['similarity', 'similarity_score_threshold', 'mmr'] = 'similarity',
+        search_type: Literal['similarity', 'similarity_score_threshold', 'mmr', 'hybrid'] = 'similarity',
         search_kwargs: dict = {
             'k': 10,
-        }
+        },
+        reranker: Optional[Union[str, BaseDocumentCompressor]] = None
     ) -> ContextualCompressionRetriever:
+        '''
+            Parameters:
+                search_type: Literal['similarity', 'similarity_score_threshold', 'mmr', 'hybrid'] - The search of the
+                    base retriever, 'hybrid' fuses dense and BM25 results (search_kwargs go to get_hybrid_retriever)
+                search_kwargs: dict - The keyword arguments of the search, 'filter' takes a metadata filter (see rag.filters)
+                reranker: Optional[Union[str, BaseDocumentCompressor]] - 'cross_encoder', 'cohere' or a compressor,
+                    defaults to the RERANKER setting
+        '''
+
         torch.cuda.empty_cache()
-        retriever = self.vectorstore.as_retriever(
-            search_type=search_type,
-            search_kwargs=search_kwargs
-        )
+        if search_type == 'hybrid':
+            retriever = self.get_hybrid_retriever(**search_kwargs)
+        else:
+            search_kwargs = dict(search_kwargs)
+            search_kwargs.update(self.filter_kwargs(search_kwargs.pop("filter", None)))
+            retriever = self.vectorstore.as_retriever(
+                search_type=search_type,
+                search_kwargs=search_kwargs
+            )
 
-        # Compressor
-        reranker = CohereRerank(
-            model="rerank-multilingual-v3.0",
-            cohere_api_key=envConfig.COHERE_API_KEY
-        )
+        # Compressor, shared between retrievers
         compression_retriever = ContextualCompressionRetriever(
-            base_compressor=reranker, base_retriever=retriever
+            base_compressor=self.get_reranker(reranker), base_retriever=retriever
         )
 
-        del reranker
-
         return compression_retriever
 
-    def get_compression_multivector_retriever(self) -> ContextualCompressionRetriever:
+    def get_compression_multivector_retriever(
+        self,
+        search_kwargs: dict = {
+            'k': 10,
+        },
+        reranker: Optional[Union[str, BaseDocumentCompressor]] = None
+    ) -> ContextualCompressionRetriever:
+        '''
+            Searches the small chunks and returns (reranked) their parent pages, read from the persistent docstore
+
+            Parameters:
+                search_kwargs: dict - The keyword arguments of the chunk search, 'filter' takes a metadata filter
+                reranker: Optional[Union[str, BaseDocumentCompressor]] - 'cross_encoder', 'cohere' or a compressor,
+                    defaults to the RERANKER setting
+        '''
+
+        if self.docstore is None:
+            raise ValueError(f"Vector store {self.name} was created without a parent docstore")
+
+        search_kwargs = dict(search_kwargs)
+        search_kwargs.update(self.filter_kwargs(search_kwargs.pop("filter", None)))
+
         retriever = MultiVectorRetriever(
-            docstore=InMemoryStore(),
+            docstore=self.docstore,
             vectorstore=self.vectorstore,
-            byte_store=InMemoryByteStore(),
             id_key='doc_id',
+            search_kwargs=search_kwargs
         )
 
-        retriever.docstore.mset(list(zip(self.ids, self.documents)))
-
-        reranker = CohereRerank(
-            
-            model="rerank-multilingual-v3.0",
-            cohere_api_key=envConfig.COHERE_API_KEY
-        )
         compression_retriever = ContextualCompressionRetriever(
-            base_compressor=reranker, base_retriever=retriever
+            base_compressor=self.get_reranker(reranker), base_retriever=retriever
         )
-        
-        del reranker
 
         return compression_retriever
-
-
-        
@@ -0,0 +1,57 @@
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Awaitable, Iterator, Optional
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    '''
+        The process-wide event loop, running in a daemon thread. Every Streamlit session submits its
+        async work to it, so concurrent sessions share one loop instead of blocking a thread each on I/O
+    '''
+
+    global _loop
+
+    if _loop is None:
+        with _lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="async-event-loop", daemon=True).start()
+                _loop = loop
+
+    return _loop
+
+
+def run_async(coroutine: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+    '''
+        Run a coroutine on the shared event loop and wait for its result from a synchronous caller
+
+        Parameters:
+            coroutine: Awaitable[Any] - The coroutine
+            timeout: Optional[float] - The maximum number of seconds to wait
+    '''
+
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result(timeout)
+
+
+def iterate_async(iterator: AsyncIterator[Any]) -> Iterator[Any]:
+    '''
+        Consume an async iterator running on the shared event loop from a synchronous caller,
+        e.g. to feed st.write_stream
+
+        Parameters:
+            iterator: AsyncIterator[Any] - The async iterator
+    '''
+
+    async def next_item() -> Any:
+        return await iterator.__anext__()
+
+    while True:
+        try:
+            yield run_async(next_item())
+        except StopAsyncIteration:
+            return
+
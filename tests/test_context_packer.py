@@ -0,0 +1,35 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from rag.context_packer import ContextPacker
+
+
+def split(text: str, chunk_size: int, chunk_overlap: int):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+    return splitter.split_documents([Document(page_content=text, metadata={"source": "a.pdf", "page": 0})])
+
+
+def test_merge_adjacent_chunks_keeps_word_boundary():
+    text = "alpha beta gamma delta epsilon zeta"
+    chunks = split(text, chunk_size=16, chunk_overlap=0)
+    assert len(chunks) > 1
+
+    packed = ContextPacker(token_budget=1000).pack(chunks)
+
+    assert len(packed) == 1
+    assert packed[0].page_content == text
+
+
+def test_merge_overlapping_chunks_drops_shared_text():
+    text = "alpha beta gamma delta epsilon zeta eta theta"
+    chunks = split(text, chunk_size=20, chunk_overlap=10)
+    assert len(chunks) > 1
+
+    packed = ContextPacker(token_budget=1000).pack(chunks)
+
+    assert len(packed) == 1
+    assert packed[0].page_content == text
@@ -0,0 +1,62 @@
+import os
+import sys
+import zlib
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+from rag.faiss_store import TunableFAISS
+
+
+class HashEmbeddings(Embeddings):
+    def embed_query(self, text: str) -> List[float]:
+        return np.random.default_rng(zlib.crc32(text.encode("utf-8"))).normal(size=32).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+
+@pytest.mark.parametrize("index_type, index_kwargs", [
+    ('flat', {}),
+    ('ivf_pq', {"pq_m": 8}),
+    ('ivf_pq', {"pq_m": 8, "refine": True}),
+    ('hnsw', {})
+])
+def test_delete_then_search(tmp_path, index_type, index_kwargs):
+    store = TunableFAISS.open_or_create(
+        str(tmp_path), HashEmbeddings(), index_type=index_type, index_kwargs=index_kwargs, train_size=600
+    )
+    texts = [f"document {i}" for i in range(600)]
+    store.add_texts(texts, ids=texts)
+    store.persist()
+    assert store.built_index_type == index_type
+
+    store.delete(texts[:300])
+
+    assert len(store) == 300
+    for text in texts[300:310]:
+        results = store.similarity_search(text, k=3, nprobe=64)
+        assert results and all(document.id in texts[300:] for document in results)
+        assert results[0].id == text
+
+
+def test_ivf_pq_fallback_is_rebuilt_once_trainable(tmp_path):
+    store = TunableFAISS.open_or_create(
+        str(tmp_path), HashEmbeddings(), index_type='ivf_pq', index_kwargs={"pq_m": 8}, train_size=300
+    )
+    texts = [f"document {i}" for i in range(300)]
+    store.add_texts(texts[:100], ids=texts[:100])
+    store.persist()
+    assert store.built_index_type == 'flat'
+
+    store = TunableFAISS.open_or_create(
+        str(tmp_path), HashEmbeddings(), index_type='ivf_pq', index_kwargs={"pq_m": 8}, train_size=300
+    )
+    assert store.built_index_type == 'flat'
+    store.add_texts(texts[100:], ids=texts[100:])
+
+    assert store.built_index_type == 'ivf_pq'
+    assert store.similarity_search(texts[42], k=1, nprobe=64)[0].id == texts[42]
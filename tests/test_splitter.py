@@ -0,0 +1,43 @@
+import os
+import re
+import sys
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from rag.splitter import FastTextSplitter, clean_text
+
+
+def corpus(n_texts: int = 200, seed: int = 0):
+    rng = random.Random(seed)
+    words = ["vision", "convolution", "kernel", "stride", "pixel", "réseau", "image", "feature", "map", "layer", "a" * 120]
+    return [
+        "\n\n".join(
+            "\n".join(" ".join(rng.choices(words, k=rng.randint(3, 40))) for _ in range(rng.randint(1, 8)))
+                for _ in range(rng.randint(1, 12))
+        )
+            for _ in range(n_texts)
+    ]
+
+
+def test_clean_text_matches_regex():
+    for text in corpus(50) + ["naïve café ☕ 日本語", ""]:
+        assert clean_text(text) == re.sub(r'[^\x00-\x7F]+', '', text)
+
+
+@pytest.mark.parametrize("chunk_size, chunk_overlap", [(50, 0), (300, 0), (300, 50), (1000, 100)])
+@pytest.mark.parametrize("keep_separator", [True, False, "end"])
+def test_same_chunks_as_recursive_splitter(chunk_size, chunk_overlap, keep_separator):
+    kwargs = {
+        "separators": ["\n\n", "\n", " ", ""],
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "keep_separator": keep_separator
+    }
+    expected = RecursiveCharacterTextSplitter(**kwargs)
+    actual = FastTextSplitter(**kwargs)
+
+    for text in corpus():
+        assert actual.split_text(text) == expected.split_text(text)